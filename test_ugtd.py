@@ -0,0 +1,309 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""Tests for ugtd. Run with: python -m unittest test_ugtd"""
+
+import datetime
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import ugtd
+
+
+def MergedText(base, mine, theirs):
+  """MergeLines() with its result spelled out as lines of text."""
+  merged, conflicts = ugtd.MergeLines(base, mine, theirs)
+  sides = {'mine': mine, 'theirs': theirs}
+  return [sides[source][index] for source, index in merged], conflicts
+
+
+class MergeLinesTest(unittest.TestCase):
+
+  def testUnchanged(self):
+    base = ['Task one', 'Task two']
+    self.assertEqual(MergedText(base, base, base), (base, []))
+
+  def testOnlyMineChanged(self):
+    base = ['Task one', 'Task two']
+    mine = ['Task one', 'x 2026-10-19 Task two']
+    self.assertEqual(MergedText(base, mine, base), (mine, []))
+
+  def testOnlyTheirsChanged(self):
+    base = ['Task one', 'Task two']
+    theirs = ['Task one changed', 'Task two']
+    self.assertEqual(MergedText(base, base, theirs), (theirs, []))
+
+  def testSameChangeOnBothSides(self):
+    base = ['Task one', 'Task two']
+    mine = ['Task one', 'Task two changed']
+    self.assertEqual(MergedText(base, mine, list(mine)), (mine, []))
+
+  def testChangesToDifferentLines(self):
+    base = ['Task one', 'Task two', 'Task three']
+    mine = ['Task one changed', 'Task two', 'Task three']
+    theirs = ['Task one', 'Task two', 'Task three changed']
+    self.assertEqual(MergedText(base, mine, theirs),
+                     (['Task one changed', 'Task two', 'Task three changed'], []))
+
+  def testCompleteLastTaskWhileTheyAppend(self):
+    base = ['Task one', 'Task two']
+    mine = ['Task one', 'x 2026-10-19 Task two']
+    theirs = ['Task one', 'Task two', 'Cron task']
+    self.assertEqual(MergedText(base, mine, theirs),
+                     (['Task one', 'x 2026-10-19 Task two', 'Cron task'], []))
+
+  def testAppendWhileTheyChangeLastTask(self):
+    base = ['Task one', 'Task two']
+    mine = ['Task one', 'Task two', 'New task']
+    theirs = ['Task one', 'Task two changed']
+    self.assertEqual(MergedText(base, mine, theirs),
+                     (['Task one', 'Task two changed', 'New task'], []))
+
+  def testBothAppend(self):
+    base = ['Task one']
+    mine = ['Task one', 'New task']
+    theirs = ['Task one', 'Cron task']
+    self.assertEqual(MergedText(base, mine, theirs),
+                     (['Task one', 'New task', 'Cron task'], []))
+
+  def testConflict(self):
+    base = ['Task one', 'Task two']
+    mine = ['Task one', 'Task two mine']
+    theirs = ['Task one', 'Task two theirs']
+    self.assertEqual(MergedText(base, mine, theirs),
+                     (['Task one', 'Task two mine', 'Task two theirs'],
+                      [(['Task two mine'], ['Task two theirs'])]))
+
+
+class UndoTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dirname = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dirname, 'todo.txt')
+    with open(self.filename, 'w') as f:
+      f.write('Caf\xe9 task\nTask two\n')   # Not UTF-8
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def _Open(self):
+    return ugtd.TodoTxtFile(self.filename, persist_history=True)
+
+  def _Read(self):
+    with open(self.filename) as f:
+      return f.read()
+
+  def testUndoRedo(self):
+    todotxtfile = self._Open()
+    task = todotxtfile.tasks[0]
+    todotxtfile.ApplyChanges([(task, 'x Caf\xe9 task'), (None, 'New task')])
+    todotxtfile.Undo()
+    self.assertEqual(self._Read(), 'Caf\xe9 task\nTask two\n')
+    todotxtfile.Redo()
+    self.assertEqual(self._Read(), 'x Caf\xe9 task\nTask two\nNew task\n')
+
+  def testJournalSurvivesReload(self):
+    todotxtfile = self._Open()
+    task = todotxtfile.tasks[0]
+    todotxtfile.ApplyChanges([(task, 'x Caf\xe9 task')])
+    todotxtfile.ApplyChanges([(todotxtfile.tasks[1], 'Task two changed')])
+    todotxtfile.Undo()
+
+    todotxtfile = self._Open()
+    todotxtfile.Undo()
+    self.assertEqual(self._Read(), 'Caf\xe9 task\nTask two\n')
+    todotxtfile.Redo()
+    todotxtfile.Redo()
+    self.assertEqual(self._Read(), 'x Caf\xe9 task\nTask two changed\n')
+
+  def testJournalIgnoredAfterOutsideChange(self):
+    todotxtfile = self._Open()
+    todotxtfile.ApplyChanges([(todotxtfile.tasks[0], 'x Caf\xe9 task')])
+    with open(self.filename, 'w') as f:
+      f.write('Something else entirely\n')
+    self.assertEqual(self._Open().Undo(), [])
+
+
+class MergeDiskTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dirname = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dirname, 'todo.txt')
+    self._Write('Task one\nTask two\n')
+    self.todotxtfile = ugtd.TodoTxtFile(self.filename, persist_history=False)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def _Write(self, content):
+    with open(self.filename, 'w') as f:
+      f.write(content)
+
+  def _Read(self):
+    with open(self.filename) as f:
+      return f.read()
+
+  def testCompleteLastTaskWhileTheyAppend(self):
+    with open(self.filename, 'a') as f:
+      f.write('Cron task\n')
+    task = self.todotxtfile.tasks[1]
+    self.todotxtfile.ApplyChanges([(task, 'x 2026-10-19 Task two')])
+    self.assertEqual(self._Read(), 'Task one\nx 2026-10-19 Task two\nCron task\n')
+    self.assertEqual(self.todotxtfile.conflicts, [])
+
+  def testAppendKeepsUndo(self):
+    task = self.todotxtfile.tasks[0]
+    self.todotxtfile.ApplyChanges([(task, 'Task one changed')])
+    with open(self.filename, 'a') as f:
+      f.write('Cron task\n')
+    self.todotxtfile.Sync()
+    self.todotxtfile.Undo()
+    self.assertEqual(self._Read(), 'Task one\nTask two\nCron task\n')
+
+  def testMovedLinesClearUndo(self):
+    task = self.todotxtfile.tasks[1]
+    self.todotxtfile.ApplyChanges([(task, 'Task two changed')])
+    self._Write('Cron task\nTask one\nTask two changed\n')
+    self.todotxtfile.Sync()
+    self.assertEqual(self.todotxtfile.Undo(), [])
+    self.assertEqual(self._Read(), 'Cron task\nTask one\nTask two changed\n')
+
+
+@unittest.skipIf(ugtd.sqlite3 is None, 'Python has no sqlite3')
+class HistoryIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dirname = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dirname, 'todo.txt')
+    self._Write('Task one\n(A) Pay rent\nAnother task\n')
+    self.index = ugtd.HistoryIndex(self.filename)
+    self.index.Update()
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def _Write(self, content, mode='w'):
+    with open(self.filename, mode) as f:
+      f.write(content)
+
+  def _Search(self, query):
+    self.index.Update()
+    return [text for _, text in self.index.Search(query)]
+
+  def testAppendOnlyIndexesNewLines(self):
+    self._Write('Buy milk\n', 'a')
+    self.assertEqual(self.index.Update(), 1)
+    self.assertEqual(self._Search('milk'), ['Buy milk'])
+
+  def testSameLengthChange(self):
+    todotxtfile = ugtd.TodoTxtFile(self.filename)
+    task = todotxtfile.tasks[1]
+    todotxtfile.ApplyChanges([(task, task.ShiftedPriorityText('+'))])
+    self.assertEqual(self._Search('rent'), ['(B) Pay rent'])
+
+  def testSameLengthChangeAndAppend(self):
+    self._Write('Task one\n(A) Pay rent\nChanged task\nBuy milk\n')
+    self.assertEqual(self._Search('Another'), [])
+    self.assertEqual(self._Search('Changed'), ['Changed task'])
+    self.assertEqual(self._Search('milk'), ['Buy milk'])
+
+  def testLastLineWithoutNewline(self):
+    self._Write('Task one\n(A) Pay rent\nAnother')
+    self.index.Update()
+    self._Write(' thing\n', 'a')
+    self.assertEqual(self._Search('Another'), ['Another thing'])
+
+
+class MemoryBudgetTest(unittest.TestCase):
+  """Workspaces like those the MEMORY_BUDGET_* costs were measured on."""
+
+  def setUp(self):
+    self.dirname = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dirname, 'todo.txt')
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def _CheckBudget(self, count, projects, contexts, tags):
+    with open(self.filename, 'w') as f:
+      for i in xrange(count):
+        words = ['+p%d' % ((i * 7 + k * 13) % projects) for k in xrange(tags)]
+        words.extend('@c%d' % ((i + k * 3) % contexts) for k in xrange(tags))
+        f.write('%s%sTask number %d %s%s\n' % (
+            'x 2026-10-01 ' if i % 5 == 0 else '',
+            '(%s) ' % 'ABC'[i % 3] if i % 4 == 0 else '',
+            i, ' '.join(words),
+            ' due:2026-11-%02d' % (i % 28 + 1) if i % 3 == 0 else ''))
+    app = ugtd.Application(ugtd.TodoTxtFile(self.filename))
+    _, total = ugtd.MemoryReport(app)
+    self.assertLessEqual(total, ugtd.MemoryBudget(app))
+
+  def testSmallWorkspace(self):
+    self._CheckBudget(100, 10, 5, 1)
+
+  def testManyProjects(self):
+    self._CheckBudget(3000, 300, 20, 1)
+
+  def testManyTagsPerTask(self):
+    self._CheckBudget(2000, 100, 30, 3)
+
+
+class WriteJsonLinesTest(unittest.TestCase):
+
+  def testNotUtf8(self):
+    records = [ugtd.Task._Parse('Caf\xe9 task +pr\xe9'),
+               ugtd.Task._Parse('Caf\xc3\xa9 ok due:2026-01-01')]
+    for number, record in enumerate(records, 1):
+      record['line'] = number
+    out = StringIO.StringIO()
+    ugtd.WriteJsonLines(records, out)
+    first, second = [json.loads(line) for line in out.getvalue().splitlines()]
+    self.assertEqual(first['text'], u'Caf\ufffd task +pr\ufffd')
+    self.assertEqual(first['projects'], [u'pr\ufffd'])
+    self.assertEqual(second['text'], u'Caf\xe9 ok due:2026-01-01')
+    self.assertEqual(second['metadata'], {u'due': u'2026-01-01'})
+
+
+class MaterializeRecurrencesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dirname = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dirname, 'todo.txt')
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def _Materialize(self, content):
+    with open(self.filename, 'w') as f:
+      f.write(content)
+    todotxtfile = ugtd.TodoTxtFile(self.filename, persist_history=False)
+    todotxtfile.today = datetime.date(2026, 10, 19)
+    ugtd.Application(todotxtfile)._MaterializeRecurrences()
+    with open(self.filename) as f:
+      return f.read()
+
+  def testSeriesWithOpenInstanceIsLeftAlone(self):
+    content = ('Water plants rec:1w due:2026-10-25\n'
+               'x 2026-10-04 Water plants rec:1w due:2026-10-04\n'
+               'x 2026-10-11 Water plants rec:1w due:2026-10-11\n')
+    self.assertEqual(self._Materialize(content), content)
+
+  def testOnlyLatestCompletedInstanceRecurs(self):
+    self.assertEqual(self._Materialize('x 2026-10-04 Stretch +health rec:1d\n'
+                                       'x 2026-10-17 Stretch +health rec:1d\n'),
+                     'x 2026-10-04 Stretch +health\n'
+                     'x 2026-10-17 Stretch +health\n'
+                     'Stretch +health rec:1d due:2026-10-18\n')
+
+  def testRecurrenceSeriesIgnoresDates(self):
+    task = ugtd.ParsedTask(ugtd.Task._Parse(
+        'x 2026-10-11 2026-10-01 Water plants +home rec:1w due:2026-10-11'))
+    self.assertEqual(ugtd.RecurrenceSeries(task), 'Water plants +home')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -143,14 +143,40 @@ makes this possible.
 
 """
 
+import bisect
+import calendar
 import collections
+import contextlib
+import csv
 import datetime
+import difflib
+import gc
+import hashlib
 import inspect
-import itertools
+import json
+import locale
 import os
+import Queue
 import string
 import sys
+import threading
 import time
+import types
+
+try:
+  import fcntl
+except ImportError:   # Not available on Windows; writes just go unlocked there
+  fcntl = None
+
+try:
+  import tracemalloc
+except ImportError:   # Python 2; memory reports fall back to object sizes
+  tracemalloc = None
+
+try:
+  import sqlite3
+except ImportError:   # Python built without it; there is just no history index
+  sqlite3 = None
 
 import urwid
 
@@ -158,6 +184,39 @@ import urwid
 #TODO_TEXT_FILE = os.path.join(os.path.expanduser('~'), '.todo.txt')
 TODO_TEXT_FILE = os.path.join(os.path.expanduser('~'), 'todo.test.txt')
 
+# How many changes can be undone, and whether that history is kept in a
+#   journal file next to the todo.txt file so it survives restarts
+UNDO_HISTORY_DEPTH = 100
+PERSIST_UNDO_HISTORY = True
+UNDO_JOURNAL_SUFFIX = '.undo'
+
+# Writers that want to cooperate with ugtd take an exclusive flock(2) on this
+#   file (next to the todo.txt file) while they modify it, e.g. from cron:
+#     flock ~/todo.txt.lock -c 'echo "Water plants" >> ~/todo.txt'
+LOCK_SUFFIX = '.lock'
+
+# While running, files are loaded in chunks of this many lines so the screen
+#   can fill in as they arrive, and checked for changes by others this often
+LOAD_CHUNK_SIZE = 500
+WATCH_INTERVAL_SECONDS = 2
+
+# Navigation keys that pile up while the screen is being drawn (like when a
+#   key is held down) are handled once per frame of this many seconds, with
+#   each run of the same key done as one movement. The TaskPanel only follows
+#   the keyword selection once it has stayed put for a little while.
+INPUT_FRAME_SECONDS = 0.04
+KEYWORD_SETTLE_SECONDS = 0.15
+REPEATABLE_KEYS = ('up', 'down', 'page up', 'page down',
+                   'k', 'j', 'ctrl u', 'ctrl b', 'ctrl d', 'ctrl f')
+
+# The todo.txt file and the done.txt file next to it are each mirrored into an
+#   SQLite index file (if Python has sqlite3) so years of history can be
+#   searched and reported on without loading it all. The text files are always
+#   the source of truth; an index file can be deleted at any time.
+DONE_TEXT_FILE_NAME = 'done.txt'
+HISTORY_INDEX = True
+HISTORY_INDEX_SUFFIX = '.index.sqlite'
+
 DIMENSIONS = ('projects', 'contexts', 'priority')
 
 #            LABEL   -  CATEGORY  -  GROUPING
@@ -166,7 +225,55 @@ VIEWS = ((u'[Pri/Ctx]', 'priority', 'contexts'),
          (u'[Prj/Pri]', 'projects', 'priority'),
          (u'[Ctx/Prj]', 'contexts', 'projects'),
          (u'[Ctx/Pri]', 'contexts', 'priority'),
-         (u'[Pri/Prj]', 'priority', 'projects'))
+         (u'[Pri/Prj]', 'priority', 'projects'),
+         (u'[Due/Prj]', 'due',      'projects'),
+         (u'[Due/Ctx]', 'due',      'contexts'))
+
+# Saved views pin one keyword of a view and can filter its tasks further. They
+#   are kept up to date as tasks change and come after the VIEWS on the number
+#   keys (0 being the tenth view). There are eight VIEWS, so only the first two
+#   saved views get a number key; '[' and ']' step through all of the views.
+#   Filters are 'stale', 'completed', 'due' (has a due date) or 'priority<=X',
+#   any of which can be turned around with a leading 'not '.
+#               LABEL   -  CATEGORY  - KEYWORD -  GROUPING  -  FILTERS
+#SAVED_VIEWS = ((u'[Work]', 'projects', 'work',   'contexts', ('not stale', 'priority<=B')),)
+SAVED_VIEWS = ()
+
+# Keywords of the 'due' category are ranges of due dates relative to today:
+#            LABEL    -  FROM  -  UNTIL (in days from today, None if open-ended)
+DUE_RANGES = ((u'overdue',   None, 0),
+              (u'today',     0,    1),
+              (u'this week', 1,    7),
+              (u'later',     7,    None))
+
+# Memory reports ('m', or --memory without the UI) fail the --memory run if a
+#   loaded workspace takes more than its budget, so benchmark runs can catch
+#   memory regressions. What a workspace takes depends on its tasks and on how
+#   many TaskListBoxes, TaskPiles and places in piles the views give them.
+#   Measured with Python 2.7 on workspaces of 100 to 5000 tasks with 1 to 3
+#   projects and contexts each (from 30 to 1000 projects in all), the costs
+#   came to about 32K in all, plus 4.6K per task, 2.6K per TaskListBox, 3.6K
+#   per TaskPile and 170 bytes per Task in a TaskPile, which fit every
+#   measurement within 4%. The budget allows half as much again.
+#   test_ugtd.MemoryBudgetTest checks a workspace of that kind.
+MEMORY_BUDGET_BASE = 1024 * 1024
+MEMORY_BUDGET_PER_TASK = 7 * 1024
+MEMORY_BUDGET_PER_LISTBOX = 4 * 1024
+MEMORY_BUDGET_PER_PILE = 6 * 1024
+MEMORY_BUDGET_PER_PLACEMENT = 256
+
+# Which keywords the KeywordPanel lists ('f' cycles through these):
+#   all      - every keyword seen
+#   nonempty - keywords that still have tasks
+#   open     - keywords that have tasks that are not completed
+KEYWORD_FILTERS = ('all', 'nonempty', 'open')
+KEYWORD_FILTER = 'all'
+
+# Open tasks older than this many days are flagged with a '!' icon
+STALE_AFTER_DAYS = 21
+
+# Completed tasks stay visible for this many days after their completion date
+COMPLETED_VISIBLE_DAYS = 2
 
 
 class Border(urwid.LineBox):
@@ -188,10 +295,24 @@ class Border(urwid.LineBox):
     return u'┤ %s ├' % text
 
 
+def PanelPadding():
+  """Padding for a panel's ListBox, holding an empty one until it arrives.
+
+  The empty ListBox keeps the panel selectable: urwid containers decide whether
+  their contents are selectable when built, and the real ListBox only arrives
+  later.
+  """
+  return urwid.Padding(urwid.ListBox([]), left=1, right=1)
+
+
 class Task(urwid.WidgetPlaceholder):
 
   def __init__(self, S, todotxtfile):
     self._todotxtfile = todotxtfile
+    self.marked = False
+    self._version = 0
+    self._canvases = {}
+    self._canvas_width = None
     self.UpdateFromString(S)
     super(Task, self).__init__(self.text_widget_attrmap)
 
@@ -207,10 +328,32 @@ class Task(urwid.WidgetPlaceholder):
   def keypress(self, size, key):
     return key
 
+  def render(self, size, focus=False):
+    """Render through a cache of canvases for this version of the task.
+
+    The same Task is shown in many TaskListBoxes, and urwid only keeps a
+    canvas around while something else still refers to it, so without this
+    every redraw and view switch lays out the text all over again. Only the
+    canvases for the current width are kept, so a resize drops the rest.
+    """
+    width = size[0]
+    if width != self._canvas_width:
+      self._canvases = {}
+      self._canvas_width = width
+    key = (size, focus, self._version)
+    canvas = self._canvases.get(key)
+    if canvas is None:
+      canvas = super(Task, self).render(size, focus)
+      self._canvases[key] = canvas
+    return canvas
+
   def _BuildTextWidget(self):
+    # Whatever we looked like before, cached canvases no longer apply
+    self._version += 1
+    self._canvases = {}
     if self.completed:
       icon = 'x'
-    elif self.creation_date and (datetime.date.today() - self.creation_date).days > 21:
+    elif self.IsStale(self._todotxtfile.today):
       icon = '!'
     else:
       icon = ' '
@@ -218,12 +361,16 @@ class Task(urwid.WidgetPlaceholder):
                                    '[%s]' % icon,
                                    ' ',
                                    self.text])
-    self.text_widget_attrmap = urwid.AttrMap(self.text_widget,
-                                     {'prefix': 'prefix:normal', None: 'normal'},
+    if self.marked:
+      attr_map = {'prefix': 'prefix:marked', None: 'marked'}
+    else:
+      attr_map = {'prefix': 'prefix:normal', None: 'normal'}
+    self.text_widget_attrmap = urwid.AttrMap(self.text_widget, attr_map,
                                      {'prefix': 'prefix:selected', None: 'selected'})
     return self.text_widget_attrmap
 
-  def _Parse(self, line):
+  @staticmethod
+  def _Parse(line):
     """Parse a single-line string S as a task in the todo.txt format.
 
     See: https://github.com/ginatrapani/todo.txt-cli/wiki/The-Todo.txt-Format
@@ -290,9 +437,22 @@ class Task(urwid.WidgetPlaceholder):
     # Body - main part of text after priority/dates but with contexts/projects in-tact
     body = line_stripped
 
-    # Contexts and projects
+    # Convert a key:value metadata value to a date or number where possible
+    def typed(value):
+      try:
+        time_struct = time.strptime(value, '%Y-%m-%d')
+      except ValueError:
+        pass
+      else:
+        return datetime.date(*time_struct[:3])
+      if value.isdigit():
+        return int(value)
+      return value
+
+    # Contexts, projects and key:value metadata (like due:2016-01-31)
     contexts = []
     projects = []
+    metadata = {}
     for word in line_stripped.split():
       if word.startswith('+'):
         prj = word[1:]
@@ -302,6 +462,11 @@ class Task(urwid.WidgetPlaceholder):
         ctx = word[1:]
         if ctx:
           contexts.append(ctx)
+      elif ':' in word:
+        key, value = word.split(':', 1)
+        # Leave URLs (http://...) alone
+        if key.isalnum() and value and not value.startswith('//'):
+          metadata[key] = typed(value)
 
     return {'text':            line,
             'body':            body,
@@ -311,6 +476,7 @@ class Task(urwid.WidgetPlaceholder):
             'completed':       completed,
             'contexts':        contexts,
             'projects':        projects,
+            'metadata':        metadata,
            }
 
   def UpdateFromString(self, S):
@@ -325,6 +491,7 @@ class Task(urwid.WidgetPlaceholder):
       self.body            = ''
       self.projects        = []
       self.contexts        = []
+      self.metadata        = {}
 
     else:
       # Skim off the top line if given a multi-line string
@@ -341,10 +508,130 @@ class Task(urwid.WidgetPlaceholder):
       self.body            = values['body']
       self.projects        = values['projects']
       self.contexts        = values['contexts']
+      self.metadata        = values['metadata']
 
     # Update the widget
     self.original_widget = self._BuildTextWidget()
 
+  @property
+  def due(self):
+    """The due:YYYY-MM-DD date of this task, or None."""
+    due = self.metadata.get('due')
+    if isinstance(due, datetime.date):
+      return due
+    return None
+
+  def RefreshWidget(self):
+    """Rebuild the text widget so date-dependent icons are current."""
+    self.original_widget = self._BuildTextWidget()
+
+  def SetMarked(self, marked):
+    """Highlight (or stop highlighting) this task as part of a selection."""
+    if marked != self.marked:
+      self.marked = marked
+      self.original_widget = self._BuildTextWidget()
+
+  def CompletedText(self, today):
+    """Return the text this task would have if completed on 'today'."""
+    if self.completed:
+      return self.text
+    return 'x %s %s' % (today.isoformat(), self.text.strip())
+
+  def PriorityText(self, priority):
+    """Return the text this task would have with the given priority.
+
+    A priority of None removes the priority. Completed tasks are left alone.
+    """
+    if self.completed:
+      return self.text
+    text = self.text.strip()
+    if self.priority:
+      text = text[text.find(') ') + 2:].lstrip()
+    if priority:
+      return '(%s) %s' % (priority, text)
+    return text
+
+  def ShiftedPriorityText(self, key):
+    """Return the text after a '+' or '-' priority change, as in TaskEdit."""
+    if key == '+':
+      if self.priority is None:
+        return self.PriorityText('A')
+      elif self.priority != 'Z':
+        return self.PriorityText(chr(ord(self.priority) + 1))
+    elif key == '-':
+      if self.priority == 'A':
+        return self.PriorityText(None)
+      elif self.priority:
+        return self.PriorityText(chr(ord(self.priority) - 1))
+    return self.text
+
+  def TaggedText(self, add=(), remove=()):
+    """Return the text with the words in 'add' appended and 'remove' dropped."""
+    words = [w for w in self.text.split() if w not in remove]
+    words.extend(w for w in add if w not in words)
+    return ' '.join(words)
+
+  def IsStale(self, today):
+    """Whether this task is open and was created too long before 'today'."""
+    if self.completed or not self.creation_date:
+      return False
+    return (today - self.creation_date).days > STALE_AFTER_DAYS
+
+  def IsVisible(self, today):
+    """Whether this task should be shown in the TaskPanel on 'today'.
+
+    Open tasks are always visible. Completed tasks are only visible for a short
+    while after their completion date.
+    """
+    if not self.completed:
+      return True
+    if not self.completion_date:
+      return False
+    return (today - self.completion_date).days < COMPLETED_VISIBLE_DAYS
+
+  def NextStateChangeDate(self, today):
+    """Return the first date after 'today' on which IsStale() or IsVisible()
+    will give a different answer, or None if the task never changes again.
+    """
+    if self.completed:
+      if not self.completion_date:
+        return None
+      change_date = self.completion_date + datetime.timedelta(COMPLETED_VISIBLE_DAYS)
+    elif self.creation_date:
+      change_date = self.creation_date + datetime.timedelta(STALE_AFTER_DAYS + 1)
+    else:
+      return None
+    if change_date > today:
+      return change_date
+    return None
+
+
+class ParsedTask(object):
+  """The parsed fields of a task without any of the widgets of a Task.
+
+  It answers the same questions about dates as a Task does, so the filters of
+  saved views work on both.
+  """
+
+  def __init__(self, values):
+    self.__dict__.update(values)
+
+  due = Task.due
+  IsStale = Task.IsStale.im_func
+  IsVisible = Task.IsVisible.im_func
+
+
+def TaskKeywords(task, category, today):
+  """The keywords a Task (or ParsedTask) has in a category on 'today'."""
+  if category == 'due':
+    if task.due is None:
+      return []
+    return [DueRangeLabel(task.due, today)]
+  keywords = getattr(task, category)
+  if not hasattr(keywords, '__iter__'):
+    keywords = [keywords]
+  return keywords
+
 
 class Keyword(urwid.WidgetPlaceholder):
 
@@ -466,6 +753,31 @@ class TaskEdit(urwid.Edit):
       return super(TaskEdit, self).keypress(size, key)
 
 
+class Prompt(urwid.Edit):
+  """Single-line Edit shown in the footer to ask the user for some text."""
+
+  def __init__(self, caption, callback, app):
+    self.callback = callback
+    self.app = app
+    super(Prompt, self).__init__(('editbox:caption', caption))
+
+  def EnteredText(self):
+    """The entered text as a UTF-8 byte string, like the lines of the file."""
+    text = self.edit_text
+    if isinstance(text, unicode):
+      text = text.encode('utf-8')
+    return text
+
+  def keypress(self, size, key):
+    if key == 'enter':
+      self.app.ClosePrompt()
+      self.callback(self.EnteredText())
+    elif key == 'esc':
+      self.app.ClosePrompt()
+    else:
+      return super(Prompt, self).keypress(size, key)
+
+
 class VimNavigationListBox(urwid.ListBox):
   """ListBox that also accepts vim navigation keys."""
 
@@ -487,6 +799,8 @@ class VimNavigationListBox(urwid.ListBox):
     super(VimNavigationListBox, self).__init__(items)
 
   def keypress(self, size, key):
+    key, count = SplitRepeatedKey(key)
+
     if self.edit_mode:
       # Ignore page up/down in edit mode
       if key in ('page up', 'page down'):
@@ -497,7 +811,43 @@ class VimNavigationListBox(urwid.ListBox):
       if self.VIM_KEYS.has_key(key):
         key = self.VIM_KEYS[key]
 
-    return super(VimNavigationListBox, self).keypress(size, key)
+    for _ in range(count):
+      unhandled = super(VimNavigationListBox, self).keypress(size, key)
+      if unhandled:
+        break
+    return unhandled
+
+
+def RepeatKey(key, count):
+  """A single key that stands for pressing 'key' 'count' times."""
+  if count == 1:
+    return key
+  return '%s*%d' % (key, count)
+
+
+def SplitRepeatedKey(key):
+  """The (key, count) of a RepeatKey() key, which may be a plain key."""
+  head, _, count = key.rpartition('*')
+  if head and count.isdigit():
+    return head, int(count)
+  return key, 1
+
+
+def CoalesceKeys(keys):
+  """Collapse each run of the same REPEATABLE_KEYS key into one RepeatKey().
+
+  Keys from the first other key on are left alone, since that key may start
+  something (like editing a task) where these keys mean something else.
+  """
+  coalesced = []
+  i = 0
+  while i < len(keys) and keys[i] in REPEATABLE_KEYS:
+    j = i
+    while j < len(keys) and keys[j] == keys[i]:
+      j += 1
+    coalesced.append(RepeatKey(keys[i], j - i))
+    i = j
+  return coalesced + list(keys[i:])
 
 
 class TaskPile(urwid.Pile):
@@ -535,21 +885,19 @@ class TaskPile(urwid.Pile):
 
       # Exit edit mode
       if key in ('enter', 'esc'):
-        # Submit changes if any
-        if key == 'enter':
-          edit_widget = self.focus.original_widget
-          if self._preserved_task.text != edit_widget.get_edit_text():
-            # Get before/after properties and update the task itself
-            old_properties = self._preserved_task.__dict__.copy()
-            self._preserved_task.UpdateFromString(edit_widget.get_edit_text())
-            new_properties = self._preserved_task.__dict__.copy()
-            # Start a chain reaction so all widgets can deal with the changes
-            self.tasklistbox.DoTaskChangeWork(old_properties, new_properties)
-
-        self.contents[self.focus_position] = (self._preserved_task, ('pack', None))
+        task = self._preserved_task
+        new_text = self.focus.original_widget.get_edit_text()
+
+        self.contents[self.focus_position] = (task, ('pack', None))
         self._preserved_task = None
         self.tasklistbox.edit_mode = False
         self._mode = 'nav'
+
+        # Submit changes if any. This starts a chain reaction so all widgets
+        #   can deal with the changes, so do it only after we are back in
+        #   'nav' mode with the Task in its place.
+        if key == 'enter' and task.text != new_text:
+          self.tasklistbox.taskpanel.app.startTaskChange([(task, new_text)])
         return
 
       return super(TaskPile, self).keypress(size, key)
@@ -559,10 +907,38 @@ class TaskPile(urwid.Pile):
     widget = urwid.AttrMap(widget, 'editbox', 'editbox')
     return widget
 
+  def InsertTask(self, task, sorting):
+    """Insert a Task into this group, keeping tasks sorted by 'sorting'."""
+    keys = [getattr(t, sorting) for t in self.tasks]
+    index = bisect.bisect_right(keys, getattr(task, sorting))
+    self.tasks.insert(index, task)
+    # Offset by one for the group title at the top of the pile
+    self.contents.insert(index + 1, (task, ('pack', None)))
+
+  def RemoveTask(self, task):
+    """Remove a Task from this group."""
+    index = self.tasks.index(task)
+    del self.tasks[index]
+    del self.contents[index + 1]
+
 
 class TaskListBox(VimNavigationListBox):
+  """ListBox of TaskPiles for one (category, keyword, grouping) combination.
+
+  Besides navigation, this supports a vim-like visual mode for acting on many
+  tasks at once. Press 'v' to anchor a selection on the focused task and move
+  to extend it, then apply one of the BULK_KEYS actions to every selected task:
+
+      x     - mark completed
+      + / - - shift priority
+      p     - set priority (prompted; empty to clear)
+      t / T - add / remove words such as +project or @context (prompted)
+      d     - delete
+
+  Each action is applied as a single Application.startTaskChange transaction.
   """
-  """
+
+  BULK_KEYS = ('x', '+', '-', 'p', 't', 'T', 'd')
 
   def __init__(self, piles, taskpanel, category, keyword, grouping):
     # 'items' -> 'tasks'
@@ -572,104 +948,766 @@ class TaskListBox(VimNavigationListBox):
     self.category = category
     self.keyword = keyword
     self.grouping = grouping
-    self._mode = 'nav'
+    self.sorting = Sorting(category, grouping)
+    self._visual_anchor = None   # (pile, task) where the selection started
+    self._selected = set()
     super(TaskListBox, self).__init__(piles, taskpanel)
 
+  def keypress(self, size, key):
+    ###################
+    ### NAV MODE
+    if self._visual_anchor is None:
+      if key == 'v' and not self.edit_mode and self._FocusEntry():
+        self._visual_anchor = self._FocusEntry()
+        self._UpdateSelection()
+        return
+      return super(TaskListBox, self).keypress(size, key)
+
+    ###################
+    ### VISUAL MODE
+    if key in ('v', 'esc'):
+      self.ExitVisualMode()
+      return
+    elif key in self.BULK_KEYS:
+      self._StartBulkAction(key)
+      return
+    elif key == 'enter':
+      return   # No editing in the middle of a selection
+
+    key = super(TaskListBox, self).keypress(size, key)
+    self._UpdateSelection()
+    return key
+
   def _BuildEditWidget(self, task):
     widget = TaskEdit(task)
     widget = urwid.AttrMap(widget, 'editbox', 'editbox')
     return widget
 
-  def DoTaskChangeWork(self, old_properties, new_properties):
-    ########################
-    ### Added task
-    if not old_properties:
-      groups_added_to = new_properties[self.grouping]
-      if not hasattr(groups_added_to, '__iter__'):
-        groups_added_to = [groups_added_to]
-      groups_removed_from = []
-
-    ########################
-    ### Deleted task
-    elif not new_properties:
-      groups_removed_from = old_properties[self.grouping]
-      if not hasattr(groups_removed_from, '__iter__'):
-        groups_removed_from = [groups_removed_from]
-      groups_added_to = []
-
-    ########################
-    ### Modified task
+  def _FocusEntry(self):
+    """The (pile, task) under the cursor, or None."""
+    pile = self.focus
+    if pile is None or not isinstance(pile.focus, Task):
+      return None
+    return (pile, pile.focus)
+
+  def _Entries(self):
+    """Every (pile, task) in display order."""
+    return [(pile, task) for pile in self.body for task in pile.tasks]
+
+  def _UpdateSelection(self):
+    entries = self._Entries()
+    cursor = self._FocusEntry()
+    if cursor not in entries:
+      return
+    if self._visual_anchor not in entries:
+      self._visual_anchor = cursor
+    start = entries.index(self._visual_anchor)
+    end = entries.index(cursor)
+    if start > end:
+      start, end = end, start
+
+    selected = set(task for _, task in entries[start:end + 1])
+    for task in self._selected - selected:
+      task.SetMarked(False)
+    for task in selected - self._selected:
+      task.SetMarked(True)
+    self._selected = selected
+
+  def SelectedTasks(self):
+    """Selected tasks in display order, each listed once."""
+    tasks = []
+    for _, task in self._Entries():
+      if task in self._selected and task not in tasks:
+        tasks.append(task)
+    return tasks
+
+  def ExitVisualMode(self):
+    for task in self._selected:
+      task.SetMarked(False)
+    self._selected = set()
+    self._visual_anchor = None
+
+  def _StartBulkAction(self, key):
+    tasks = self.SelectedTasks()
+    app = self.taskpanel.app
+
+    if key == 'x':
+      today = app.todotxtfile.today
+      self._FinishBulkAction([(t, t.CompletedText(today)) for t in tasks])
+    elif key in ('+', '-'):
+      self._FinishBulkAction([(t, t.ShiftedPriorityText(key)) for t in tasks])
+    elif key == 'd':
+      self._FinishBulkAction([(t, None) for t in tasks])
+
+    elif key == 'p':
+      def SetPriority(text):
+        priority = text.strip().upper() or None
+        if priority is None or (len(priority) == 1 and priority in string.uppercase):
+          self._FinishBulkAction([(t, t.PriorityText(priority)) for t in tasks])
+      app.OpenPrompt(u'Priority: ', SetPriority)
+
+    elif key == 't':
+      def AddWords(text):
+        self._FinishBulkAction([(t, t.TaggedText(add=text.split())) for t in tasks])
+      app.OpenPrompt(u'Add: ', AddWords)
+
+    elif key == 'T':
+      def RemoveWords(text):
+        self._FinishBulkAction([(t, t.TaggedText(remove=text.split())) for t in tasks])
+      app.OpenPrompt(u'Remove: ', RemoveWords)
+
+  def _FinishBulkAction(self, changes):
+    self.ExitVisualMode()
+    self.taskpanel.app.startTaskChange(changes)
+
+  def _GroupLabels(self, task):
+    """Labels of the TaskPiles a Task belongs to in this listbox."""
+    group_value = getattr(task, self.grouping)
+    if hasattr(group_value, '__iter__'):
+      groups = group_value or [None]
     else:
-      old_group = old_properties[self.grouping]
-      new_group = new_properties[self.grouping]
-      if hasattr(old_group, '__iter__'):
-        groups_removed_from = set(old_group) - set(new_group)
-        groups_removed_from = sorted(groups_removed_from)
-        groups_added_to = set(new_group) - set(old_group)
-        groups_added_to = sorted(groups_added_to)
+      groups = [group_value]
+    return [GroupLabel(g) for g in groups]
+
+  def _FindPile(self, label):
+    for pile in self.body:
+      if pile.group == label:
+        return pile
+    return None
+
+  def InsertTask(self, task):
+    """Add a Task to every group it belongs to, creating groups as needed."""
+    for label in self._GroupLabels(task):
+      pile = self._FindPile(label)
+      if pile is None:
+        pile = TaskPile([task], label, self)
+        labels = [GroupSortKey(p.group) for p in self.body]
+        index = bisect.bisect_right(labels, GroupSortKey(label))
+        self.body.insert(index, pile)
       else:
-        if old_group != new_group:
-          groups_removed_from = [old_group]
-          groups_added_to = [new_group]
-        else:
-          groups_removed_from = []
-          groups_added_to = []
+        pile.InsertTask(task, self.sorting)
+
+  def RemoveTask(self, task):
+    """Remove a Task from every group it is in, dropping emptied groups.
+
+    This looks the Task up by identity rather than by its groups, since the
+    Task may already have been changed to belong somewhere else.
+    """
+    for pile in list(self.body):
+      if task not in pile.tasks:
+        continue
+      pile.RemoveTask(task)
+      if not pile.tasks:
+        self.body.remove(pile)
+
+
+def GroupLabel(group):
+  """Title text of the TaskPile for a group value."""
+  if group is None:
+    return u'--none--'
+  if isinstance(group, str):
+    return group.decode('utf-8', 'replace')
+  return unicode(group)
+
+
+def GroupSortKey(label):
+  """Sort key for TaskPile titles, keeping '--none--' at the top."""
+  return (label != u'--none--', label)
+
+
+def Sorting(category, grouping):
+  """The Task attribute to sort by within groups of a view."""
+  # Tasks by due date are best sorted by it
+  if category == 'due':
+    return 'due'
+  # Otherwise we sort by whatever is not the category or grouping dimension
+  return set(DIMENSIONS).difference((category, grouping)).pop()
+
+
+def AllViews():
+  """(label, view) of the VIEWS and then the SAVED_VIEWS, in number key order.
+
+  A view is (category, grouping), or (category, grouping, label) for a saved
+  view.
+  """
+  views = [(label, (category, grouping)) for label, category, grouping in VIEWS]
+  views.extend((label, (category, grouping, label))
+               for label, category, _, grouping, _ in SAVED_VIEWS)
+  return views
+
+
+def ViewFilter(spec):
+  """The predicate(task, today) for one of the filters of a saved view."""
+  if spec.startswith('not '):
+    predicate = ViewFilter(spec[4:])
+    return lambda task, today: not predicate(task, today)
+  elif spec == 'stale':
+    return lambda task, today: task.IsStale(today)
+  elif spec == 'completed':
+    return lambda task, today: task.completed
+  elif spec == 'due':
+    return lambda task, today: task.due is not None
+  elif spec.startswith('priority<='):
+    lowest = spec[len('priority<='):]
+    return lambda task, today: task.priority is not None and task.priority <= lowest
+  raise ValueError('Unknown saved view filter: %r' % spec)
+
+
+def DueRange(label, today):
+  """The (start, end) dates of a DUE_RANGES label, either of which may be None."""
+  for range_label, start, end in DUE_RANGES:
+    if range_label == label:
+      if start is not None:
+        start = today + datetime.timedelta(start)
+      if end is not None:
+        end = today + datetime.timedelta(end)
+      return start, end
+  raise KeyError(label)
+
+
+def DueRangeLabel(due, today):
+  """The DUE_RANGES label for a due date."""
+  days = (due - today).days
+  for label, start, end in DUE_RANGES:
+    if (start is None or days >= start) and (end is None or days < end):
+      return label
+
+
+class DateIndex(object):
+  """Sorted index of Tasks by the dates in their key:value metadata.
+
+  For each key (due, t, ...) there is a sorted list of dates and a parallel
+  list of Tasks, so finding every Task in a range of dates is just two
+  bisections instead of a scan over all the Tasks.
+  """
+
+  def __init__(self, tasks=()):
+    self._dates = {}     # key -> sorted list of dates
+    self._tasks = {}     # key -> list of Tasks in the same order as the dates
+    self._indexed = {}   # Task -> list of (key, date) it is indexed under
+
+    # Sort everything once up front rather than inserting one by one
+    entries = collections.defaultdict(list)
+    for task in tasks:
+      for key, date in self._DatesOf(task):
+        entries[key].append((date, task))
+        self._indexed.setdefault(task, []).append((key, date))
+    for key, pairs in entries.items():
+      pairs.sort(key=lambda pair: pair[0])
+      self._dates[key] = [date for date, _ in pairs]
+      self._tasks[key] = [task for _, task in pairs]
+
+  def _DatesOf(self, task):
+    return [(key, value) for key, value in task.metadata.items()
+            if isinstance(value, datetime.date)]
+
+  def Add(self, task):
+    entries = self._DatesOf(task)
+    for key, date in entries:
+      dates = self._dates.setdefault(key, [])
+      index = bisect.bisect_right(dates, date)
+      dates.insert(index, date)
+      self._tasks.setdefault(key, []).insert(index, task)
+    if entries:
+      self._indexed[task] = entries
+
+  def Remove(self, task):
+    for key, date in self._indexed.pop(task, []):
+      dates = self._dates[key]
+      tasks = self._tasks[key]
+      start = bisect.bisect_left(dates, date)
+      end = bisect.bisect_right(dates, date)
+      index = tasks.index(task, start, end)
+      del dates[index]
+      del tasks[index]
+
+  def Between(self, key, start=None, end=None):
+    """Tasks whose 'key' date is in [start, end), in date order.
+
+    A start or end of None leaves that side of the range open.
+    """
+    dates = self._dates.get(key, [])
+    if start is None:
+      i = 0
+    else:
+      i = bisect.bisect_left(dates, start)
+    if end is None:
+      j = len(dates)
+    else:
+      j = bisect.bisect_left(dates, end)
+    return self._tasks.get(key, [])[i:j]
+
+  def doTaskChange(self, changes):
+    for task, old_text, new_text in changes:
+      self.Remove(task)
+      if new_text is not None:
+        self.Add(task)
+
+
+def KeywordSortKey(keyword):
+  """Sort key for keywords, keeping None (no keyword) at the top."""
+  return (keyword is not None, keyword)
+
+
+class TagIndex(object):
+  """Counts of open and completed Tasks for every keyword of each dimension.
+
+  Keywords stay in the index (with counts of zero) after their last Task is
+  gone, so the KeywordPanel can still list them if asked to.
+  """
+
+  def __init__(self, tasks=()):
+    self._sort_keys = dict((category, []) for category in DIMENSIONS)
+    self._counts = {}   # (category, keyword) -> [open, completed]
+    for task in tasks:
+      self._Count(self._Tags(task.projects, task.contexts, task.priority),
+                  task.completed, 1)
+
+  @staticmethod
+  def _Tags(projects, contexts, priority):
+    return ([('projects', p) for p in projects] +
+            [('contexts', c) for c in contexts] +
+            [('priority', priority)])
+
+  def _Count(self, tags, completed, delta):
+    for tag in tags:
+      counts = self._counts.get(tag)
+      if counts is None:
+        category, keyword = tag
+        counts = self._counts[tag] = [0, 0]
+        bisect.insort(self._sort_keys[category], KeywordSortKey(keyword))
+      counts[completed] += delta
+
+  def _Versions(self, changes):
+    # The tags of the before (-1) and after (+1) of each change
+    for task, old_text, new_text in changes:
+      if old_text is not None:
+        old = Task._Parse(old_text)
+        yield (self._Tags(old['projects'], old['contexts'], old['priority']),
+               old['completed'], -1)
+      if new_text is not None:
+        yield (self._Tags(task.projects, task.contexts, task.priority),
+               task.completed, 1)
+
+  def Keywords(self, category):
+    """All keywords of a dimension, sorted."""
+    return [keyword for _, keyword in self._sort_keys[category]]
+
+  def Counts(self, category, keyword):
+    """The (open, completed) number of Tasks with a keyword."""
+    return tuple(self._counts.get((category, keyword), (0, 0)))
+
+  def Affected(self, changes):
+    """The set of (category, keyword) whose counts a batch of changes touch."""
+    return set(tag for tags, _, _ in self._Versions(changes) for tag in tags)
+
+  def doTaskChange(self, changes):
+    for tags, completed, delta in self._Versions(changes):
+      self._Count(tags, completed, delta)
+
+
+def ParseRecurrence(value):
+  """The (strict, count, unit) of a rec: value like '1w' or '+3d', or None.
+
+  Units are d(ays), w(eeks), m(onths) and y(ears). Strict ('+') recurrences
+  count from the old due date rather than from the day the task was done.
+  """
+  if not isinstance(value, basestring):
+    return None
+  strict = value.startswith('+')
+  count, unit = value[strict:-1], value[-1:]
+  if not count.isdigit() or not unit or unit not in 'dwmy':
+    return None
+  return strict, int(count), unit
+
+
+def AddInterval(date, count, unit):
+  """The date 'count' days, weeks, months or years after 'date'."""
+  if unit == 'd':
+    return date + datetime.timedelta(count)
+  elif unit == 'w':
+    return date + datetime.timedelta(7 * count)
+  if unit == 'y':
+    count *= 12
+  month = date.month - 1 + count
+  year = date.year + month // 12
+  month = month % 12 + 1
+  # Like Jan 31 + 1 month, which is the end of February
+  day = min(date.day, calendar.monthrange(year, month)[1])
+  return datetime.date(year, month, day)
+
+
+def NextRecurrenceDates(task, done_date):
+  """The new due: and/or t: dates for the next instance of a recurring task.
+
+  The due date moves on by the recurrence and the threshold (t:) date moves
+  with it. Without a due date the threshold date moves on by itself, and with
+  neither the next instance gets a due date.
+  """
+  strict, count, unit = ParseRecurrence(task.metadata.get('rec'))
+  due = task.due
+  threshold = task.metadata.get('t')
+  if not isinstance(threshold, datetime.date):
+    threshold = None
+
+  dates = {}
+  if due is not None:
+    dates['due'] = AddInterval(strict and due or done_date, count, unit)
+    if threshold is not None:
+      dates['t'] = threshold + (dates['due'] - due)
+  elif threshold is not None:
+    dates['t'] = AddInterval(strict and threshold or done_date, count, unit)
+  else:
+    dates['due'] = AddInterval(done_date, count, unit)
+  return dates
+
+
+def NextRecurrence(task, done_date):
+  """The text of the next instance of a recurring task done on 'done_date'."""
+  dates = NextRecurrenceDates(task, done_date)
+  words = []
+  for word in task.body.split():
+    key = word.split(':', 1)[0]
+    if ':' in word and key in dates:
+      word = '%s:%s' % (key, dates.pop(key).isoformat())
+    words.append(word)
+  words.extend('%s:%s' % (key, date.isoformat()) for key, date in sorted(dates.items()))
+  text = ' '.join(words)
+  if task.creation_date:
+    text = '%s %s' % (done_date.isoformat(), text)
+  if task.priority:
+    text = '(%s) %s' % (task.priority, text)
+  return text
+
+
+def RecurrenceDate(task):
+  """The day the next instance of a completed recurring task is due to appear.
+
+  That is its t: (threshold) date if it has one, or else right away. This is
+  None for tasks that do not recur.
+  """
+  if ParseRecurrence(task.metadata.get('rec')) is None:
+    return None
+  if task.completion_date is None:
+    return datetime.date.min
+  return NextRecurrenceDates(task, task.completion_date).get('t', task.completion_date)
+
+
+def WithoutRecurrence(text):
+  """Task text with its rec: dropped."""
+  return ' '.join(word for word in text.split() if not word.startswith('rec:'))
+
+
+def RecurrenceSeries(task):
+  """What all instances of a recurring task have in common.
+
+  That is the task's body without its rec: and its dates, so an instance and
+  the one created after it (by ugtd or another tool) are in the same series.
+  """
+  words = []
+  for word in task.body.split():
+    key = word.split(':', 1)[0]
+    if ':' in word and (key == 'rec' or
+                        isinstance(task.metadata.get(key), datetime.date)):
+      continue
+    words.append(word)
+  return ' '.join(words)
+
+
+class RecurrenceSchedule(DateIndex):
+  """Completed recurring tasks, by the day their next instance is due.
+
+  A recurring task loses its rec: once its next instance has been created, so
+  the completed tasks that still have one are the ones waiting for theirs:
+  ones whose next instance starts at a later t: date, and ones completed by
+  something other than ugtd (which may have created the next instance itself).
+  Due() finds them all with one range lookup.
+  """
+
+  def _DatesOf(self, task):
+    if not task.completed:
+      return []
+    date = RecurrenceDate(task)
+    if date is None:
+      return []
+    return [('rec', date)]
+
+  def Due(self, today):
+    return self.Between('rec', None, today + datetime.timedelta(1))
+
+
+class KeywordWalker(urwid.ListWalker):
+  """ListWalker over a sorted list of keywords.
+
+  Keyword widgets are only built for the positions the ListBox asks for, so
+  a long list costs little more than the list of strings.
+  """
+
+  def __init__(self, keywords):
+    self._keywords = list(keywords)
+    self._sort_keys = [KeywordSortKey(k) for k in self._keywords]
+    self._widgets = {}
+    self.focus = 0
+
+  def __len__(self):
+    return len(self._keywords)
+
+  def _Widget(self, position):
+    keyword = self._keywords[position]
+    widget = self._widgets.get(keyword)
+    if widget is None:
+      widget = self._widgets[keyword] = Keyword(keyword or u'--none--')
+    return widget
+
+  def get_focus(self):
+    if not self._keywords:
+      return None, None
+    return self._Widget(self.focus), self.focus
+
+  def set_focus(self, position):
+    self.focus = position
+    self._modified()
+
+  def get_next(self, position):
+    if position + 1 >= len(self._keywords):
+      return None, None
+    return self._Widget(position + 1), position + 1
+
+  def get_prev(self, position):
+    if position <= 0:
+      return None, None
+    return self._Widget(position - 1), position - 1
+
+  def positions(self, reverse=False):
+    if reverse:
+      return reversed(xrange(len(self._keywords)))
+    return xrange(len(self._keywords))
+
+  def Find(self, keyword):
+    """Position of a keyword, or None."""
+    index = bisect.bisect_left(self._sort_keys, KeywordSortKey(keyword))
+    if index < len(self._keywords) and self._keywords[index] == keyword:
+      return index
+    return None
+
+  def FindPrefix(self, prefix):
+    """Position of the first keyword starting with prefix, or None."""
+    index = bisect.bisect_left(self._sort_keys, (True, prefix))
+    if index < len(self._keywords) and self._keywords[index].startswith(prefix):
+      return index
+    return None
+
+  def Insert(self, keyword):
+    sort_key = KeywordSortKey(keyword)
+    index = bisect.bisect_right(self._sort_keys, sort_key)
+    self._sort_keys.insert(index, sort_key)
+    self._keywords.insert(index, keyword)
+    # Keep the focus on the same keyword
+    if index <= self.focus and len(self._keywords) > 1:
+      self.focus += 1
+    self._modified()
+
+  def Remove(self, keyword):
+    index = self.Find(keyword)
+    if index is None:
+      return
+    del self._sort_keys[index]
+    del self._keywords[index]
+    self._widgets.pop(keyword, None)
+    if index < self.focus or self.focus >= len(self._keywords):
+      self.focus = max(self.focus - 1, 0)
+    self._modified()
+
+  def SetKeywords(self, keywords):
+    """Replace all the keywords, keeping the focus near where it was."""
+    if self._keywords:
+      focus_key = self._sort_keys[self.focus]
+    else:
+      focus_key = None
+    self._keywords = list(keywords)
+    self._sort_keys = [KeywordSortKey(k) for k in self._keywords]
+    self._widgets = dict((k, w) for k, w in self._widgets.items()
+                         if k in self._keywords)
+    if focus_key is None:
+      self.focus = 0
+    else:
+      index = bisect.bisect_left(self._sort_keys, focus_key)
+      self.focus = max(min(index, len(self._keywords) - 1), 0)
+    self._modified()
 
 
 class KeywordPanel(urwid.WidgetPlaceholder):
   """Panel to hold the keywords and allow selection of tasks.
 
+  The keywords come from the Application's TagIndex and only the ones that
+  scroll into view get widgets, so thousands of them are no problem. Press 'f'
+  to cycle through the KEYWORD_FILTERS, or '/' to jump to the first keyword
+  starting with what you type.
   """
 
-  def __init__(self, app, keywords_dict={}):
+  def __init__(self, app):
     self.app = app
-    self._keywords_dict = keywords_dict
+    self.filter = KEYWORD_FILTER
+    self._walkers = {}
     self._listboxes = {}
-    for cat,keywords in self._keywords_dict.items():
-      kw_widgets = [Keyword(k or u'--none--') for k in keywords]
-      listbox = VimNavigationListBox(kw_widgets, self)
-      self._keywords_dict[cat] = kw_widgets
-      self._listboxes[cat] = listbox
-    self._selected_category = self._keywords_dict.keys()[0]
-    self.padding_widget = urwid.Padding(urwid.SolidFill(u'x'), left=1, right=1)
+    for category in DIMENSIONS + ('due',):
+      walker = KeywordWalker(self._ListedKeywords(category))
+      self._walkers[category] = walker
+      self._listboxes[category] = VimNavigationListBox(walker, self)
+    self._selected_category = DIMENSIONS[0]
+    self._pinned = False
+    self._shown = None          # (category, keyword) the TaskPanel was told about
+    self._settle_alarm = None
+    self.padding_widget = PanelPadding()
     self.border_widget = Border(self.padding_widget, 'Empty')
     super(KeywordPanel, self).__init__(self.border_widget)
 
   def render(self, size, focus=False):
     """Intercept render() in case it's because the selected keyword changed.
+
+    While the UI is running, everybody is only told once the selection has
+    stayed on one keyword for KEYWORD_SETTLE_SECONDS, so scrolling through
+    keywords does not swap in every TaskListBox on the way.
     """
-    self.app.startKeywordChange(self.GetSelectedKeyword(), None)
+    if (self._selected_category, self.GetSelectedKeyword()) != self._shown:
+      main_loop = self.app.main_loop
+      if main_loop is None:
+        self._OnKeywordSettled(None, None)
+      else:
+        if self._settle_alarm is not None:
+          main_loop.remove_alarm(self._settle_alarm)
+        self._settle_alarm = main_loop.set_alarm_in(KEYWORD_SETTLE_SECONDS,
+                                                    self._OnKeywordSettled)
     return super(KeywordPanel, self).render(size, focus)
 
-  def GetKeywords(self, category):
-    keywords = []
-    for w in self._listboxes[category].body.contents:
-      text = w.text_widget.text
-      if text == '--none--':
-        keywords.append(None)
-      else:
-        keywords.append(text)
-    return keywords
+  def _OnKeywordSettled(self, main_loop, user_data):
+    self._settle_alarm = None
+    old_keyword = self._shown and self._shown[1]
+    new_keyword = self.GetSelectedKeyword()
+    self._shown = (self._selected_category, new_keyword)
+    self.app.startKeywordChange(new_keyword, old_keyword)
+
+  def keypress(self, size, key):
+    # Saved views stay on their own keyword, so only let focus move across
+    if self._pinned and key != 'f':
+      key, _ = SplitRepeatedKey(key)
+      key = VimNavigationListBox.VIM_KEYS.get(key, key)
+      if key in ('up', 'down', 'page up', 'page down', 'home', 'end', '/'):
+        return None
+      return key
+
+    if key == 'f':
+      index = KEYWORD_FILTERS.index(self.filter)
+      self.SetFilter(KEYWORD_FILTERS[(index + 1) % len(KEYWORD_FILTERS)])
+    elif key == '/':
+      prompt = self.app.OpenPrompt(u'Jump to: ', self.JumpToPrefix)
+      urwid.connect_signal(prompt, 'change',
+                           lambda widget, text: self.JumpToPrefix(text))
+    else:
+      return super(KeywordPanel, self).keypress(size, key)
+
+  def mouse_event(self, size, event, button, col, row, focus):
+    if self._pinned:
+      return False
+    return super(KeywordPanel, self).mouse_event(size, event, button, col, row,
+                                                 focus)
+
+  def _Lists(self, category, keyword):
+    if self.filter == 'all':
+      return True
+    open_count, completed_count = self.app.tag_index.Counts(category, keyword)
+    if self.filter == 'open':
+      return open_count > 0
+    return open_count + completed_count > 0
+
+  def _ListedKeywords(self, category):
+    if category == 'due':
+      return [label for label, _, _ in DUE_RANGES]
+    return [k for k in self.app.tag_index.Keywords(category)
+            if self._Lists(category, k)]
+
+  def _SetTitle(self):
+    title = self._selected_category.capitalize()
+    if self._pinned:
+      title = '%s (pinned)' % title
+    elif self.filter != 'all':
+      title = '%s (%s)' % (title, self.filter)
+    self.border_widget.set_title(title)
+
+  def SetFilter(self, keyword_filter):
+    """List only the keywords that pass one of the KEYWORD_FILTERS."""
+    self.filter = keyword_filter
+    for category in DIMENSIONS:
+      self._walkers[category].SetKeywords(self._ListedKeywords(category))
+    self._SetTitle()
+
+  def JumpToPrefix(self, prefix):
+    """Select the first keyword in the current view starting with prefix."""
+    if isinstance(prefix, unicode):
+      prefix = prefix.encode('utf-8')
+    walker = self._walkers[self._selected_category]
+    position = walker.FindPrefix(prefix)
+    if position is not None:
+      self._listboxes[self._selected_category].set_focus(position)
+
+  def ResetFocus(self):
+    """Select the first keyword of every category, unless a view is pinned.
+
+    Keywords arriving while the file loads move the selection around to keep
+    it on the same keyword; this puts it back at the top once they are in.
+    """
+    if self._pinned:
+      return
+    for category in self._listboxes:
+      if len(self._walkers[category]):
+        self._listboxes[category].set_focus(0)
 
   def GetSelectedKeyword(self):
     """Get the keyword that is selected and in the current view."""
-    text = self._listboxes[self._selected_category].focus.text
+    focus = self._listboxes[self._selected_category].focus
+    if focus is None:
+      return None
+    text = focus.text
     if text == '--none--':
       return None
     else:
       return text
 
   def doViewChange(self, new_view, old_view):
-    new_category,_ = new_view
+    new_category = new_view[0]
     if new_category in self._listboxes:
       listbox = self._listboxes[new_category]
       self.padding_widget.original_widget = listbox
-      self.border_widget.set_title(new_category.capitalize())
       self._selected_category = new_category
+      # Saved views show the keyword they are pinned to
+      self._pinned = len(new_view) > 2
+      if self._pinned:
+        for label, _, keyword, _, _ in SAVED_VIEWS:
+          if label == new_view[2]:
+            position = self._walkers[new_category].Find(keyword)
+            if position is not None:
+              listbox.set_focus(position)
+      self._SetTitle()
+      # The TaskPanel picks the keyword up from us in its own doViewChange
+      self._shown = (new_category, self.GetSelectedKeyword())
 
   def doKeywordChange(self, new_keyword, old_keyword):
     return
 
+  def doDayChange(self, new_day, old_day, tasks):
+    return
+
+  def doTaskChange(self, changes):
+    """List or unlist the keywords whose tasks changed, as the filter says."""
+    for category, keyword in self.app.tag_index.Affected(changes):
+      walker = self._walkers[category]
+      listed = walker.Find(keyword) is not None
+      if self._Lists(category, keyword):
+        if not listed:
+          walker.Insert(keyword)
+      elif listed:
+        walker.Remove(keyword)
+
 
 class TaskPanel(urwid.WidgetPlaceholder):
 
@@ -677,102 +1715,159 @@ class TaskPanel(urwid.WidgetPlaceholder):
     self.app = app
     self.tasks = tasks
     self._listboxes = {}
+    self._placements = collections.defaultdict(list)   # Task -> TaskListBoxes
 
     # We only want to deal with tasks that are incomplete or recently completed
-    tasks = []
-    for task in self.tasks:
-      if task.completed:
-        if task.completion_date:
-          if (datetime.date.today() - task.completion_date).days < 2:
-            tasks.append(task)
-      else:
-        tasks.append(task)
-
-    # Build ListBoxes for every permutation of (category, keyword, grouping)
-    permutations = itertools.permutations(DIMENSIONS)
-    for category, grouping, sorting in permutations:
-      for keyword in self.app.keyword_panel.GetKeywords(category):
-        # Find matching Tasks
-        matching_tasks = []
-        for task in tasks:
-          that_keyword = getattr(task, category)
-          if hasattr(that_keyword, '__iter__') and keyword in that_keyword:
-            matching_tasks.append(task)
-          elif that_keyword == keyword:
-            matching_tasks.append(task)
-        # Group matching Tasks
-        groups = collections.defaultdict(list)
-        for task in matching_tasks:
-          group_value = getattr(task, grouping)
-          if hasattr(group_value, '__iter__'):
-            if len(group_value) == 0:
-              groups[None].append(task)
-            else:
-              [groups[g].append(task) for g in group_value]
-          else:
-            groups[group_value].append(task)
-        # Sort tasks in each group by 'sorting'
-        for group_tasks in groups.values():
-          group_tasks.sort(key=lambda t: getattr(t, sorting))
-
-        # Create a ListBox from groups
-        piles = []
-        for group in sorted(groups):
-          if group is None:
-            group_label = u'--none--'
-          else:
-            group_label = unicode(group)
-          pile = TaskPile(groups[group], group_label, None)
-          piles.append(pile)
-
-        # Add listbox to our set of ListBoxes
-        key = (category, keyword, grouping)
-        listbox = TaskListBox(piles, self, category, keyword, grouping)
-        self._listboxes[key] = listbox
-
-        # Ensure all piles have a reference to the listbox
-        for pile in piles:
-          pile.tasklistbox = listbox 
+    today = self.app.todotxtfile.today
+    tasks = [task for task in self.tasks if task.IsVisible(today)]
+
+    # Find the Tasks for every keyword in one pass
+    matching = collections.defaultdict(list)   # (category, keyword) -> Tasks
+    for task in tasks:
+      for category in DIMENSIONS:
+        for keyword in self._KeywordsOf(task, category):
+          matching[category, keyword].append(task)
+    for label, _, _ in DUE_RANGES:
+      start, end = DueRange(label, today)
+      matching['due', label] = [task for task in
+                                self.app.date_index.Between('due', start, end)
+                                if task.IsVisible(today)]
+
+    # Build ListBoxes for every view's (category, keyword, grouping) that has
+    #   Tasks. The rest are created empty when they are first needed.
+    for _, category, grouping in VIEWS:
+      for (that_category, keyword), matching_tasks in matching.items():
+        if that_category == category:
+          key = (category, keyword, grouping)
+          self._listboxes[key] = self._BuildListBox(category, keyword, grouping,
+                                                    matching_tasks)
+
+    # Saved views are built up front too, filtering the Tasks of their keyword
+    self._saved_views = []
+    self._saved_listboxes = {}
+    for label, category, keyword, grouping, filters in SAVED_VIEWS:
+      predicates = [ViewFilter(spec) for spec in filters]
+      self._saved_views.append((label, category, keyword, predicates))
+      matching_tasks = [task for task in matching.get((category, keyword), [])
+                        if all(p(task, today) for p in predicates)]
+      self._saved_listboxes[label] = self._BuildListBox(category, keyword,
+                                                        grouping, matching_tasks)
 
     # Create decorative widgets and initialize ourselves
-    self.padding_widget = urwid.Padding(urwid.SolidFill(u'x'), left=1, right=1)
+    self.padding_widget = PanelPadding()
     self.border_widget = Border(self.padding_widget, 'Empty')
     super(TaskPanel, self).__init__(self.border_widget)
 
     self.category = ''
     self.grouping = ''
     self.sorting = ''
+    self.status = ''
+    self.saved_view = None   # Label of the saved view being shown, if any
+
+  def _BuildListBox(self, category, keyword, grouping, matching_tasks):
+    sorting = Sorting(category, grouping)
+
+    # Group matching Tasks
+    groups = collections.defaultdict(list)
+    for task in matching_tasks:
+      group_value = getattr(task, grouping)
+      if hasattr(group_value, '__iter__'):
+        if len(group_value) == 0:
+          groups[None].append(task)
+        else:
+          [groups[g].append(task) for g in group_value]
+      else:
+        groups[group_value].append(task)
+    # Sort tasks in each group by 'sorting'
+    for group_tasks in groups.values():
+      group_tasks.sort(key=lambda t: getattr(t, sorting))
+
+    # Create a ListBox from groups
+    piles = []
+    for group in sorted(groups):
+      pile = TaskPile(groups[group], GroupLabel(group), None)
+      piles.append(pile)
+    listbox = TaskListBox(piles, self, category, keyword, grouping)
+
+    # Ensure all piles have a reference to the listbox
+    for pile in piles:
+      pile.tasklistbox = listbox
+
+    for task in matching_tasks:
+      self._placements[task].append(listbox)
+    return listbox
 
   def _SetTitle(self):
     title = 'Tasks by %s' % self.grouping.capitalize()
+    if self.saved_view is not None:
+      title = '%s in %s' % (title, self.saved_view)
+    if self.status:
+      title = '%s (%s)' % (title, self.status)
     self.border_widget.set_title(title)
 
-  def DoTaskChangeWork(self, old_properties, new_properties):
-    ########################
-    ### Added task
-    if not old_properties:
-      return
+  def SetStatus(self, status):
+    """Show a short status, like loading progress, next to the title."""
+    self.status = status
+    self._SetTitle()
 
-    ########################
-    ### Deleted task
-    elif not new_properties:
-      return
+  def _GetListBox(self, category, keyword, grouping):
+    """Get the TaskListBox for a combination, creating an empty one if new."""
+    key = (category, keyword, grouping)
+    if key not in self._listboxes:
+      self._listboxes[key] = TaskListBox([], self, category, keyword, grouping)
+    return self._listboxes[key]
+
+  def IsEditing(self):
+    """Whether a task in the shown TaskListBox is being edited."""
+    listbox = self.padding_widget.original_widget
+    return isinstance(listbox, TaskListBox) and listbox.edit_mode
+
+  def _ShowListBox(self, listbox):
+    old_listbox = self.padding_widget.original_widget
+    if old_listbox is not listbox:
+      if isinstance(old_listbox, TaskListBox):
+        old_listbox.ExitVisualMode()
+      self.padding_widget.original_widget = listbox
 
-    ########################
-    ### Modified task
-    else:
-      for listbox in self._listboxes.values():
-        listbox.DoTaskChangeWork(old_properties, new_properties)
+  def _KeywordsOf(self, task, category):
+    return TaskKeywords(task, category, self.app.todotxtfile.today)
 
-  def doViewChange(self, new_view, old_view):
-    category, grouping = new_view
-    keyword = self.app.keyword_panel.GetSelectedKeyword()
+  def _ListBoxesFor(self, task):
+    """Yield every TaskListBox whose category keyword matches a Task.
 
-    listbox = self._listboxes[(category, keyword, grouping)]
-    self.padding_widget.original_widget = listbox
+    ListBoxes are created for keywords we have not seen before.
+    """
+    for _, category, grouping in VIEWS:
+      for keyword in self._KeywordsOf(task, category):
+        yield self._GetListBox(category, keyword, grouping)
+    today = self.app.todotxtfile.today
+    for label, category, keyword, predicates in self._saved_views:
+      if (keyword in self._KeywordsOf(task, category) and
+          all(p(task, today) for p in predicates)):
+        yield self._saved_listboxes[label]
+
+  def _PlaceTask(self, task):
+    listboxes = list(self._ListBoxesFor(task))
+    for listbox in listboxes:
+      listbox.InsertTask(task)
+    self._placements[task] = listboxes
+
+  def _UnplaceTask(self, task):
+    for listbox in self._placements.pop(task, []):
+      listbox.RemoveTask(task)
 
-    # We sort by whatever is not the category or grouping dimension
-    sorting = set(DIMENSIONS).difference((category, grouping)).pop()
+  def doViewChange(self, new_view, old_view):
+    category, grouping = new_view[:2]
+    if len(new_view) > 2:
+      self.saved_view = new_view[2]
+      listbox = self._saved_listboxes[self.saved_view]
+    else:
+      self.saved_view = None
+      keyword = self.app.keyword_panel.GetSelectedKeyword()
+      listbox = self._GetListBox(category, keyword, grouping)
+    self._ShowListBox(listbox)
+
+    sorting = Sorting(category, grouping)
 
     self.category = category
     self.grouping = grouping
@@ -781,10 +1876,52 @@ class TaskPanel(urwid.WidgetPlaceholder):
     self._SetTitle()
 
   def doKeywordChange(self, new_keyword, old_keyword):
-    listbox = self._listboxes[(self.category, new_keyword, self.grouping)]
-    self.padding_widget.original_widget = listbox
+    # Saved views stay on their own keyword
+    if self.saved_view is not None:
+      return
+    listbox = self._GetListBox(self.category, new_keyword, self.grouping)
+    self._ShowListBox(listbox)
     self._SetTitle()
 
+  def doDayChange(self, new_day, old_day, tasks):
+    """Move only those tasks whose visibility or due range changed overnight."""
+    # Tasks due within a range boundary's worth of days moved to another range
+    due_tasks = set()
+    for _, start, end in DUE_RANGES:
+      for offset in (start, end):
+        if offset is not None:
+          offset = datetime.timedelta(offset)
+          due_tasks.update(self.app.date_index.Between('due', old_day + offset,
+                                                       new_day + offset))
+    for task in due_tasks:
+      self._UnplaceTask(task)
+      if task.IsVisible(new_day):
+        self._PlaceTask(task)
+
+    for task in tasks:
+      if task in due_tasks:
+        continue
+      was_visible = task.IsVisible(old_day)
+      is_visible = task.IsVisible(new_day)
+      if was_visible == is_visible:
+        # Still shown, but saved views may filter on it having gone stale
+        if is_visible and self._saved_views:
+          self._UnplaceTask(task)
+          self._PlaceTask(task)
+        continue
+      if is_visible:
+        self._PlaceTask(task)
+      else:
+        self._UnplaceTask(task)
+
+  def doTaskChange(self, changes):
+    """Regroup all changed tasks in one pass over the affected ListBoxes."""
+    today = self.app.todotxtfile.today
+    for task, old_text, new_text in changes:
+      self._UnplaceTask(task)
+      if new_text is not None and task.IsVisible(today):
+        self._PlaceTask(task)
+
 
 class ViewPanel(Border):
   """Top panel with selectable 'views' on Task data.
@@ -798,13 +1935,13 @@ class ViewPanel(Border):
 
     # Create urwid.Text widgets and save them in a mapping
     text_widgets = {}
-    for label, category, grouping in VIEWS:
-      view = (category, grouping)
+    for label, view in AllViews():
       text_widgets[view] = urwid.Text(('normal', label))
     self.text_widgets = text_widgets
 
     # Place urwid.Text widgets in the UI
-    widget = urwid.Columns([(11, text_widgets[V[1:]]) for V in VIEWS])
+    widget = urwid.Columns([(max(11, len(label) + 2), text_widgets[view])
+                            for label, view in AllViews()])
     widget = urwid.Padding(widget, left=1)
     super(ViewPanel, self).__init__(widget)
 
@@ -827,32 +1964,601 @@ class ViewPanel(Border):
   def doKeywordChange(self, new_keyword, old_keyword):
     return
 
+  def doDayChange(self, new_day, old_day, tasks):
+    return
+
+  def doTaskChange(self, changes):
+    return
+
+
+def ReplaceFile(filename, chunks):
+  """Write strings from 'chunks' to a file in a way that never half-writes it.
+
+  The content goes to a temporary file which then replaces the original. A
+  symlinked file is replaced at the end of the link, and its mode is kept.
+  """
+  filename = os.path.realpath(filename)
+  tmp_filename = '%s.tmp' % filename
+  with open(tmp_filename, 'w') as f:
+    try:
+      os.fchmod(f.fileno(), os.stat(filename).st_mode & 07777)
+    except OSError:
+      pass
+    for chunk in chunks:
+      f.write(chunk)
+    f.flush()
+    os.fsync(f.fileno())
+  os.rename(tmp_filename, filename)
+
+
+def MergeLines(base, mine, theirs):
+  """Three-way merge of lists of lines, in the manner of diff3.
+
+  'base' is the common ancestor of 'mine' and 'theirs'. Lines of 'base' that
+  are unchanged in both act as sync points. Between sync points, whichever side
+  changed wins. If one side changed a stretch and the other only added lines
+  after it, the change is kept followed by the added lines. If both sides
+  changed the same stretch differently, both versions are kept (mine first)
+  and the stretch is reported as a conflict.
+
+  Returns (merged, conflicts), where 'merged' is a list of ('mine', index) and
+  ('theirs', index) entries saying where each line of the result comes from and
+  'conflicts' is a list of (mine_lines, theirs_lines).
+  """
+  def MatchedLines(other):
+    matcher = difflib.SequenceMatcher(None, base, other, autojunk=False)
+    matched = {}
+    for i, j, n in matcher.get_matching_blocks():
+      for k in xrange(n):
+        matched[i + k] = j + k
+    return matched
+
+  to_mine = MatchedLines(mine)
+  to_theirs = MatchedLines(theirs)
+  sync_points = [i for i in xrange(len(base)) if i in to_mine and i in to_theirs]
+  sync_points.append(len(base))
+
+  merged = []
+  conflicts = []
+  b = m = t = 0
+  for i in sync_points:
+    mi = to_mine.get(i, len(mine))
+    ti = to_theirs.get(i, len(theirs))
+    base_chunk, mine_chunk, theirs_chunk = base[b:i], mine[m:mi], theirs[t:ti]
+
+    if theirs_chunk == base_chunk or theirs_chunk == mine_chunk:
+      merged.extend(('mine', k) for k in xrange(m, mi))
+    elif mine_chunk == base_chunk:
+      merged.extend(('theirs', k) for k in xrange(t, ti))
+
+    # One side only added lines after the stretch (e.g. cron appending tasks)
+    elif theirs_chunk[:len(base_chunk)] == base_chunk:
+      merged.extend(('mine', k) for k in xrange(m, mi))
+      merged.extend(('theirs', k) for k in xrange(t + len(base_chunk), ti))
+    elif mine_chunk[:len(base_chunk)] == base_chunk:
+      merged.extend(('theirs', k) for k in xrange(t, ti))
+      merged.extend(('mine', k) for k in xrange(m + len(base_chunk), mi))
+
+    else:
+      merged.extend(('mine', k) for k in xrange(m, mi))
+      merged.extend(('theirs', k) for k in xrange(t, ti))
+      conflicts.append((mine_chunk, theirs_chunk))
+
+    if i < len(base):
+      merged.append(('mine', mi))
+    b, m, t = i + 1, mi + 1, ti + 1
+
+  return merged, conflicts
+
+
+def ReadFileIfChanged(filename, disk):
+  """Read a file unless it is still what 'disk' describes.
+
+  'disk' is a (digest, (inode, size, mtime)) pair from an earlier read, or None.
+  Returns (content, digest, stat) or None if the file's inode, size and mtime
+  are all unchanged.
+  """
+  stat = os.stat(filename)
+  if disk is not None and (stat.st_ino, stat.st_size, stat.st_mtime) == disk[1]:
+    return None
+  with open(filename) as f:
+    stat = os.fstat(f.fileno())
+    content = f.read()
+  return content, hashlib.sha1(content).hexdigest(), stat
+
+
+class BackgroundWorker(object):
+  """Runs blocking work on a thread and hands results back to the main loop.
+
+  Jobs run one at a time, in the order they were submitted, so file I/O done
+  through a single worker never overlaps. Each job's callback is called from
+  the urwid main loop (via MainLoop.watch_pipe), never from the worker thread,
+  so callbacks are free to touch widgets. A job that returns a generator has
+  its callback called once per yielded value, which lets long jobs report
+  progress as they go.
+  """
+
+  def __init__(self, main_loop):
+    self._jobs = Queue.Queue()
+    self._results = collections.deque()
+    self._pipe = main_loop.watch_pipe(self._OnResults)
+    self._thread = threading.Thread(target=self._Run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Submit(self, func, args=(), callback=None):
+    """Run func(*args) on the worker thread and later call callback(result)."""
+    self._jobs.put((func, args, callback))
+
+  def _Post(self, callback, result, error):
+    self._results.append((callback, result, error))
+    os.write(self._pipe, 'x')
+
+  def _Run(self):
+    while True:
+      func, args, callback = self._jobs.get()
+      try:
+        result = func(*args)
+        if inspect.isgenerator(result):
+          for value in result:
+            self._Post(callback, value, None)
+        else:
+          self._Post(callback, result, None)
+      except Exception as error:
+        self._Post(None, None, error)
+
+  def _OnResults(self, data):
+    while self._results:
+      callback, result, error = self._results.popleft()
+      if error is not None:
+        raise error   # Fail as loudly as if the work was done right here
+      if callback is not None:
+        callback(result)
+    return True
+
 
 class TodoTxtFile(object):
   """Manages I/O for a todo.txt file.
+
+  [Undo Journal]
+  Every batch of changes is recorded as a list of (index, old_text, new_text)
+  deltas, where 'index' is the line number in the file. Line numbers are
+  stable: deleted tasks leave an empty line behind and new tasks are appended.
+  An old_text of None means the line was added and a new_text of None means it
+  was deleted. Undoing a batch just applies its deltas backwards with old and
+  new swapped, so no copies of Tasks are needed.
+
+  Before a batch is undone or redone, each line is checked against the text the
+  delta expects. If they disagree, the history no longer describes the file and
+  it is thrown away.
+
+  [Other Writers]
+  Other programs may change the file while we have it open. Every write takes
+  an advisory lock (see LOCK_SUFFIX) and first checks whether the file on disk
+  is still the one we last read or wrote, by inode/size/mtime and then by hash.
+  If it changed, the disk version is three-way merged with ours using what we
+  last saw as the base (see MergeLines), so nothing the other writer did is
+  lost. Lines that conflict are kept in both versions and listed in
+  self.conflicts. Since merging moves line numbers around, it also clears the
+  undo history.
   """
 
-  def __init__(self, filename):
+  def __init__(self, filename, history_depth=UNDO_HISTORY_DEPTH,
+               persist_history=False, load=True):
     self.filename = filename
-    self._lines = open(filename).read().splitlines()
     self.tasks = []
+    self.conflicts = []
+    self._lines = []
+
+    # The current date as far as Tasks are concerned. This is only updated by
+    #   the DayScheduler so that a whole session agrees on what "today" is.
+    self.today = datetime.date.today()
+
+    # Undo/redo history
+    self._undo = collections.deque(maxlen=history_depth)
+    self._redo = collections.deque(maxlen=history_depth)
+    if persist_history:
+      self._journal_filename = filename + UNDO_JOURNAL_SUFFIX
+    else:
+      self._journal_filename = None
+
+    # What we last read from or wrote to disk, as the base for merging
+    self._base_lines = []
+    self._disk_hash = None
+    self._disk_stat = None
+
+    # Background I/O. When a BackgroundWorker is set, file I/O happens on its
+    #   thread and on_change is called with any changes that were merged in
+    #   from other writers once the I/O is done. Without one, everything
+    #   happens right away and such changes are returned to the caller.
+    self.worker = None
+    self.on_change = None
+    self._writing = False
+    self._write_pending = False
+
+    # With load=False, the caller loads the file later via LoadInChunks(),
+    #   AddLoadedLines() and FinishLoading(). Nothing is written until then.
+    self.loaded = False
+    if load:
+      for kind, value in self.LoadInChunks():
+        if kind == 'lines':
+          self.AddLoadedLines(value)
+        else:
+          self.FinishLoading(*value)
 
-    # Create Tasks and insert them into our file representation, self._lines
-    # For empty lines or lines with only spaces, we ignore them. But for lines
-    #   with content, we create a Task and keep that task's place in the file
-    #   by puting it right back into our self._lines where we found it.
-    for i, line in enumerate(self._lines):
-      if line and not line.isspace():
-        task = Task(line, self)
-        self._lines[i] = task  # replace text with a Task object
-        self.tasks.append(task)
+  def LoadInChunks(self, chunk_size=LOAD_CHUNK_SIZE):
+    """Read the file and parse it into Tasks, a chunk of lines at a time.
+
+    This is a generator which only touches the disk and creates Tasks, so it
+    can run on a BackgroundWorker thread. It yields ('lines', lines) for each
+    chunk, where lines holds a Task for each line with content and the text
+    of any other line, and finally ('done', (content, digest, stat)).
+    """
+    content, digest, stat = ReadFileIfChanged(self.filename, None)
+    lines = content.splitlines()
+    for start in xrange(0, len(lines), chunk_size):
+      chunk = []
+      for line in lines[start:start + chunk_size]:
+        # For empty lines or lines with only spaces, we ignore them. But for
+        #   lines with content, we create a Task and keep that task's place in
+        #   the file by keeping it in self._lines where we found it.
+        if line and not line.isspace():
+          chunk.append(Task(line, self))
+        else:
+          chunk.append(line)
+      yield 'lines', chunk
+    yield 'done', (content, digest, stat)
+
+  def AddLoadedLines(self, lines):
+    """Take on a chunk of lines from LoadInChunks().
+
+    Returns a list of (task, None, text) for the new Tasks, like ApplyChanges().
+    """
+    changes = []
+    for line in lines:
+      self._lines.append(line)
+      if isinstance(line, Task):
+        self.tasks.append(line)
+        changes.append((line, None, line.text))
+    return changes
+
+  def FinishLoading(self, content, digest, stat):
+    """Finish what LoadInChunks() started.
+
+    Writes any changes made while loading. Returns a list of (task, old_text,
+    new_text), like ApplyChanges(), for anything merged in while doing so.
+    """
+    self._RememberDisk(content, digest, stat)
+    self.loaded = True
+    if self._journal_filename is not None and not self._undo:
+      self._LoadJournal()
+    if self._write_pending:
+      self._write_pending = False
+      return self._RewriteFile()
+    return []
+
+  def _RememberDisk(self, content, digest, stat):
+    self._base_lines = content.splitlines()
+    self._disk_hash = digest
+    self._disk_stat = (stat.st_ino, stat.st_size, stat.st_mtime)
+
+  def _DiskKey(self):
+    return (self._disk_hash, self._disk_stat)
+
+  @contextlib.contextmanager
+  def _Lock(self):
+    """Hold an exclusive advisory lock for the duration of a 'with' block."""
+    if fcntl is None:
+      yield
+      return
+    with open(self.filename + LOCK_SUFFIX, 'a') as lock_file:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+  def _ReadIfChanged(self, disk):
+    """ReadFileIfChanged() with the lock held. Only does I/O."""
+    with self._Lock():
+      return ReadFileIfChanged(self.filename, disk)
+
+  def _WriteIfUnchanged(self, content, disk):
+    """Write 'content' unless the file is no longer what 'disk' describes.
+
+    This only does I/O, so it can run on a BackgroundWorker thread. Returns
+    (written, content, digest, stat) for what was written or else for what is
+    on disk now.
+    """
+    with self._Lock():
+      current = ReadFileIfChanged(self.filename, disk)
+      if current is not None and current[1] != disk[0]:
+        return (False,) + current
+      ReplaceFile(self.filename, [content])
+      return True, content, hashlib.sha1(content).hexdigest(), os.stat(self.filename)
+
+  def _MergeDisk(self, content, digest, stat):
+    """Merge changes others made to the file into our lines.
+
+    Afterwards the disk content is our new merge base. Returns a list of (task,
+    old_text, new_text) for the Tasks this added or removed, like
+    ApplyChanges().
+    """
+    if digest == self._disk_hash:
+      self._RememberDisk(content, digest, stat)   # Touched but not changed
+      return []
+
+    theirs = content.splitlines()
+    mine = [str(line) for line in self._lines]
+    merged, conflicts = MergeLines(self._base_lines, mine, theirs)
+    self.conflicts.extend(conflicts)
+
+    changes = []
+    lines = []
+    kept = set()
+    moved = False
+    for source, index in merged:
+      if source == 'mine':
+        moved = moved or index != len(lines)
+        lines.append(self._lines[index])
+        kept.add(index)
+      elif theirs[index] and not theirs[index].isspace():
+        task = Task(theirs[index], self)
+        lines.append(task)
+        changes.append((task, None, task.text))
+      else:
+        lines.append(theirs[index])
+    for index, line in enumerate(self._lines):
+      if index not in kept and isinstance(line, Task):
+        changes.append((line, line.text, None))
+
+    # The undo history refers to lines by index, so it only survives the merge
+    #   if all of our lines kept their places (e.g. others just appended)
+    if moved or len(kept) < len(self._lines):
+      self._undo.clear()
+      self._redo.clear()
+
+    self._lines = lines
+    self.tasks = [line for line in lines if isinstance(line, Task)]
+    self._RememberDisk(content, digest, stat)
+    self._SaveJournal()
+    return changes
+
+  def _FinishWrite(self, result):
+    """Deal with the result of _WriteIfUnchanged().
+
+    Returns whatever _MergeDisk() does if the write did not happen.
+    """
+    written, content, digest, stat = result
+    if not written:
+      return self._MergeDisk(content, digest, stat)
+    self._RememberDisk(content, digest, stat)
+    self._SaveJournal()
+    return []
 
   def _RewriteFile(self):
     """Rewrite entire file, including any updated content.
+
+    Changes made to the file by others since we last saw it are merged in
+    first. Returns the resulting changes, like _MergeDisk(), or with a
+    BackgroundWorker, passes them to on_change later.
     """
-    with open(self.filename, 'w') as f:
-      for line in self._lines:
-        f.write('%s\n' % line)
+    if not self.loaded or self._writing:
+      self._write_pending = True
+      return []
+
+    content = ''.join('%s\n' % line for line in self._lines)
+    if self.worker is not None:
+      self._writing = True
+      self.worker.Submit(self._WriteIfUnchanged, (content, self._DiskKey()),
+                         self._OnWritten)
+      return []
+
+    changes = []
+    while True:
+      result = self._WriteIfUnchanged(content, self._DiskKey())
+      changes.extend(self._FinishWrite(result))
+      if result[0]:
+        return changes
+      content = ''.join('%s\n' % line for line in self._lines)
+
+  def _OnWritten(self, result):
+    self._writing = False
+    changes = self._FinishWrite(result)
+    # Try again after a merge, or write out what changed in the meantime. Any
+    #   writes requested while this one was in flight are done together here.
+    if not result[0] or self._write_pending:
+      self._write_pending = False
+      self._RewriteFile()
+    if changes and self.on_change is not None:
+      self.on_change(changes)
+
+  def Sync(self):
+    """Pick up changes others made to the file.
+
+    The file is only written if the merge left us with something different
+    from what is on disk, i.e. when there were conflicts. Returns the resulting
+    changes, like ApplyChanges(), or with a BackgroundWorker, passes them to
+    on_change later.
+    """
+    if not self.loaded:
+      return []
+    if self.worker is not None:
+      self.worker.Submit(self._ReadIfChanged, (self._DiskKey(),), self._OnSynced)
+      return []
+    return self._FinishSync(self._ReadIfChanged(self._DiskKey()))
+
+  def _FinishSync(self, current):
+    # A write in flight will do its own merging
+    if current is None or self._writing:
+      return []
+    changes = self._MergeDisk(*current)
+    if [str(line) for line in self._lines] != self._base_lines:
+      changes.extend(self._RewriteFile())
+    return changes
+
+  def _OnSynced(self, current):
+    changes = self._FinishSync(current)
+    if changes and self.on_change is not None:
+      self.on_change(changes)
+
+  def _Fingerprint(self):
+    return [self._disk_stat[1], self._disk_stat[2]]
+
+  def _LoadJournal(self):
+    try:
+      with open(self._journal_filename) as f:
+        journal = json.load(f)
+    except (IOError, ValueError):
+      return
+
+    # The journal is only good for the file exactly as we last wrote it
+    if journal.get('fingerprint') != self._Fingerprint():
+      return
+
+    # Lines are bytes in whatever encoding the file has, which latin-1 maps one
+    #   to one onto unicode and back. Older journals were written as UTF-8.
+    encoding = journal.get('encoding', 'utf-8')
+    def Decode(text):
+      if text is None:
+        return None
+      return text.encode(encoding)
+
+    for stack, name in ((self._undo, 'undo'), (self._redo, 'redo')):
+      for deltas in journal.get(name, []):
+        stack.append([(i, Decode(old), Decode(new)) for i, old, new in deltas])
+
+  def _SaveJournal(self):
+    if self._journal_filename is None or self._disk_stat is None:
+      return
+    journal = {'fingerprint': self._Fingerprint(),
+               'encoding':    'latin-1',
+               'undo':        list(self._undo),
+               'redo':        list(self._redo)}
+    args = (self._journal_filename, [json.dumps(journal, encoding='latin-1')])
+    if self.worker is not None:
+      self.worker.Submit(ReplaceFile, args)
+    else:
+      ReplaceFile(*args)
+
+  def _LineText(self, index):
+    if index < len(self._lines):
+      return str(self._lines[index])
+    return ''
+
+  def _CanApplyDeltas(self, deltas):
+    """Whether every line is currently what 'deltas' expect it to be."""
+    pending = {}
+    for index, old_text, new_text in deltas:
+      if pending.get(index, self._LineText(index)) != (old_text or ''):
+        return False
+      pending[index] = new_text or ''
+    return True
+
+  def _ApplyDeltas(self, deltas):
+    """Apply (index, old_text, new_text) deltas to our lines and tasks.
+
+    Returns a list of (task, old_text, new_text), one per delta.
+    """
+    applied = []
+    for index, old_text, new_text in deltas:
+      # Added line
+      if old_text is None:
+        task = Task(new_text, self)
+        while len(self._lines) < index:
+          self._lines.append('')
+        if index < len(self._lines):
+          self._lines[index] = task
+        else:
+          self._lines.append(task)
+        self.tasks.append(task)
+
+      # Deleted line
+      elif new_text is None:
+        task = self._lines[index]
+        if index == len(self._lines) - 1:
+          self._lines.pop()
+        else:
+          self._lines[index] = ''
+        self.tasks.remove(task)
+
+      # Modified line
+      else:
+        task = self._lines[index]
+        task.UpdateFromString(new_text)
+
+      applied.append((task, old_text, new_text))
+    return applied
+
+  def ApplyChanges(self, changes):
+    """Apply a batch of task changes with a single rewrite of the file.
+
+    'changes' is a sequence of (task, new_text) pairs. A task of None adds a
+    new task with new_text and an empty new_text (or None) deletes the task.
+    The batch is recorded as one entry in the undo history.
+
+    Returns a list of (task, old_text, new_text) for the changes that actually
+    did something, where old_text is None for added tasks.
+    """
+    deltas = []
+    applied = []
+    for task, new_text in changes:
+      if new_text:
+        new_text = new_text.splitlines()[0]
+      else:
+        new_text = None
+
+      if task is None:
+        if new_text is None:
+          continue
+        delta = (len(self._lines), None, new_text)
+      elif new_text is None:
+        delta = (self._lines.index(task), task.text, None)
+      elif new_text != task.text:
+        delta = (self._lines.index(task), task.text, new_text)
+      else:
+        continue
+
+      applied.extend(self._ApplyDeltas([delta]))
+      deltas.append(delta)
+
+    if deltas:
+      self._undo.append(deltas)
+      self._redo.clear()
+      applied.extend(self._RewriteFile())
+    return applied
+
+  def _Replay(self, from_stack, to_stack, inverse):
+    if not from_stack:
+      return []
+    deltas = from_stack[-1]
+    if inverse:
+      to_apply = [(i, new, old) for i, old, new in reversed(deltas)]
+    else:
+      to_apply = deltas
+
+    if not self._CanApplyDeltas(to_apply):
+      self._undo.clear()
+      self._redo.clear()
+      self._SaveJournal()
+      return []
+
+    from_stack.pop()
+    applied = self._ApplyDeltas(to_apply)
+    to_stack.append(deltas)
+    applied.extend(self._RewriteFile())
+    return applied
+
+  def Undo(self):
+    """Revert the most recent batch of changes.
+
+    Returns a list of (task, old_text, new_text) like ApplyChanges().
+    """
+    return self._Replay(self._undo, self._redo, inverse=True)
+
+  def Redo(self):
+    """Re-apply the most recently undone batch of changes."""
+    return self._Replay(self._redo, self._undo, inverse=False)
 
   def RewriteTaskInFile(self, task, new_text):
     self._RewriteFile()
@@ -864,11 +2570,345 @@ class TodoTxtFile(object):
     self.tasks.remove(task)
     self._RewriteFile()
 
+  def AppendLines(self, lines):
+    """Append lines of task text to the file in one atomic write.
+
+    Neither the file nor 'lines', which can be a generator, is ever held in
+    memory all at once, so this is for adding lots of tasks to a file that
+    has not been loaded. Loaded files should use ApplyChanges() so their
+    Tasks and undo history follow along. Returns how many lines were added.
+    """
+    appended = [0]
+    def Chunks(f):
+      last = ''
+      for last in f:
+        yield last
+      if last and not last.endswith('\n'):
+        yield '\n'
+      for line in lines:
+        if isinstance(line, unicode):
+          line = line.encode('utf-8')
+        line = line.strip()
+        if line:
+          appended[0] += 1
+          yield line + '\n'
+
+    with self._Lock():
+      try:
+        f = open(self.filename)
+      except IOError:   # A new file
+        f = []
+      try:
+        ReplaceFile(self.filename, Chunks(f))
+      finally:
+        if f:
+          f.close()
+    return appended[0]
+
   def AppendTaskToFile(self, task):
     with open(self.filename, 'a') as f:
       f.write('%s\n' % task)
 
 
+class HistoryIndex(object):
+  """SQLite index of the tasks in one todo.txt-format file.
+
+  The index file sits next to the text file and holds every line along with
+  its parsed dates, priority, projects and contexts, plus a full-text index
+  (FTS5 where SQLite has it) of the task text. Update() brings it up to date
+  with the text file by comparing the byte offset and SHA-1 of every line to
+  what was indexed before, so only new or changed lines are parsed again. A
+  file that was only appended to, like done.txt usually is, is parsed from
+  where the index left off once the SHA-1 of everything before that matches.
+
+  Dates are stored as YYYY-MM-DD strings, which sort like the dates do.
+  """
+
+  SCHEMA = ['CREATE TABLE IF NOT EXISTS lines ('
+            '  line INTEGER PRIMARY KEY, offset INTEGER, hash TEXT, text TEXT,'
+            '  completed INTEGER, priority TEXT, creation_date TEXT,'
+            '  completion_date TEXT, due TEXT)',
+            'CREATE TABLE IF NOT EXISTS tags (line INTEGER, category TEXT, tag TEXT)',
+            'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)',
+            'CREATE INDEX IF NOT EXISTS tags_by_tag ON tags (category, tag)',
+            'CREATE INDEX IF NOT EXISTS tags_by_line ON tags (line)',
+            'CREATE INDEX IF NOT EXISTS lines_by_completion ON lines (completion_date)',
+            'CREATE INDEX IF NOT EXISTS lines_by_due ON lines (due)']
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.index_filename = filename + HISTORY_INDEX_SUFFIX
+    self._db = None
+    self.fts = False
+    self.disabled = False
+
+  def _Connect(self):
+    if self._db is None:
+      # Updates run on the BackgroundWorker thread, which is not the one
+      #   that created us
+      self._db = sqlite3.connect(self.index_filename, check_same_thread=False)
+      for statement in HistoryIndex.SCHEMA:
+        self._db.execute(statement)
+      try:
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts "
+                         "USING fts5(text, content='lines', content_rowid='line')")
+      except sqlite3.OperationalError:   # SQLite built without FTS5
+        self.fts = False
+      else:
+        self.fts = True
+      self._db.commit()
+    return self._db
+
+  def _GetState(self, key):
+    row = self._db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+    return row and row[0]
+
+  def _SetState(self, key, value):
+    self._db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (key, value))
+
+  def _Forget(self, line, text):
+    if self.fts:
+      self._db.execute("INSERT INTO lines_fts (lines_fts, rowid, text) "
+                       "VALUES ('delete', ?, ?)", (line, text))
+    self._db.execute('DELETE FROM tags WHERE line = ?', (line,))
+    self._db.execute('DELETE FROM lines WHERE line = ?', (line,))
+
+  def _Store(self, line, offset, digest, raw, old_text):
+    if old_text is not None:
+      self._Forget(line, old_text)
+    text = raw.rstrip('\r\n').decode('utf-8', 'replace')
+    values = Task._Parse(text)
+    def iso(date):
+      return date and date.isoformat()
+    due = values['metadata'].get('due')
+    if not isinstance(due, datetime.date):
+      due = None
+    self._db.execute('INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (line, offset, digest, text, values['completed'],
+                      values['priority'], iso(values['creation_date']),
+                      iso(values['completion_date']), iso(due)))
+    self._db.executemany('INSERT INTO tags VALUES (?, ?, ?)',
+                         [(line, category, tag)
+                          for category in ('projects', 'contexts')
+                          for tag in values[category]])
+    if self.fts:
+      self._db.execute('INSERT INTO lines_fts (rowid, text) VALUES (?, ?)',
+                       (line, text))
+
+  def Update(self):
+    """Bring the index up to date with the text file.
+
+    Returns the number of lines that had to be (re)indexed. The index is only
+    a copy of the text file, so if SQLite has trouble with it (say the index
+    file is corrupt) it is deleted and built again. If it is locked by someone
+    else, it is left for the next Update().
+    """
+    if self.disabled:
+      return 0
+    for attempt in (1, 2):
+      try:
+        return self._Update()
+      except sqlite3.OperationalError as error:
+        if 'locked' in str(error):
+          if self._db is not None:
+            self._db.rollback()
+          return 0
+        self._Drop()
+      except sqlite3.Error:
+        self._Drop()
+    self.disabled = True   # Could not even build it from scratch
+    return 0
+
+  def _Drop(self):
+    """Close and delete the index file."""
+    if self._db is not None:
+      self._db.close()
+      self._db = None
+    try:
+      os.remove(self.index_filename)
+    except OSError:
+      pass
+
+  def _Update(self):
+    try:
+      st = os.stat(self.filename)
+    except OSError:   # No such file (yet), like a missing done.txt
+      return 0
+    db = self._Connect()
+    stat = repr((st.st_ino, st.st_size, st.st_mtime))
+    if self._GetState('stat') == stat:
+      return 0
+
+    indexed = 0
+    with open(self.filename, 'rb') as f:
+      # If the file was only appended to, everything we have is still good and
+      #   we can carry on reading from where we left off. To be sure nothing
+      #   before that changed (even keeping its length), all of the bytes we
+      #   indexed are hashed again and compared to their hash from last time.
+      line_number = offset = 0
+      prefix_hash = hashlib.sha1()
+      old_size = int(self._GetState('size') or 0)
+      last = db.execute('SELECT line FROM lines ORDER BY line DESC LIMIT 1').fetchone()
+      if last is not None and old_size <= st.st_size:
+        remaining = old_size
+        chunk = ''
+        while remaining:
+          chunk = f.read(min(remaining, 1 << 16))
+          if not chunk:
+            break
+          prefix_hash.update(chunk)
+          remaining -= len(chunk)
+        # A last line without a newline may have been added to
+        if (not remaining and chunk.endswith('\n') and
+            prefix_hash.hexdigest() == self._GetState('prefix_hash')):
+          line_number, offset = last[0] + 1, old_size
+        else:
+          prefix_hash = hashlib.sha1()
+      f.seek(offset)
+
+      known = dict((row[0], row[1:]) for row in db.execute(
+          'SELECT line, offset, hash, text FROM lines WHERE line >= ?',
+          (line_number,)))
+      for raw in f:
+        prefix_hash.update(raw)
+        digest = hashlib.sha1(raw).hexdigest()
+        old_offset, old_digest, old_text = known.get(line_number, (None, None, None))
+        if digest != old_digest:
+          self._Store(line_number, offset, digest, raw, old_text)
+          indexed += 1
+        elif offset != old_offset:
+          # Same line, just moved by a change to an earlier one
+          db.execute('UPDATE lines SET offset = ? WHERE line = ?',
+                     (offset, line_number))
+        offset += len(raw)
+        line_number += 1
+
+    # Lines past the end of the file were deleted
+    for line, values in known.items():
+      if line >= line_number:
+        self._Forget(line, values[2])
+    self._SetState('stat', stat)
+    self._SetState('size', str(offset))
+    self._SetState('prefix_hash', prefix_hash.hexdigest())
+    db.commit()
+    return indexed
+
+  def Search(self, query, limit=50):
+    """(line number, text) of tasks matching a full-text query, best first.
+
+    The query uses the FTS5 query syntax, or is matched as a plain substring
+    if SQLite has no FTS5.
+    """
+    db = self._Connect()
+    if self.fts:
+      rows = db.execute('SELECT rowid, text FROM lines_fts WHERE lines_fts MATCH ? '
+                        'ORDER BY rank LIMIT ?', (query, limit))
+    else:
+      rows = db.execute('SELECT line, text FROM lines WHERE text LIKE ? '
+                        'ORDER BY line LIMIT ?', ('%' + query + '%', limit))
+    return rows.fetchall()
+
+  def CompletedCounts(self, category, start=None, end=None):
+    """(tag, count) of tasks completed in [start, end) per project or context."""
+    db = self._Connect()
+    return db.execute('SELECT tag, COUNT(*) FROM tags JOIN lines USING (line) '
+                      'WHERE category = ? AND completed '
+                      '  AND completion_date >= ? AND completion_date < ? '
+                      'GROUP BY tag ORDER BY COUNT(*) DESC, tag',
+                      (category,
+                       start and start.isoformat() or '',
+                       end and end.isoformat() or '9999')).fetchall()
+
+
+def HistoryIndexes(filename):
+  """HistoryIndexes for a todo.txt file and the done.txt file next to it.
+
+  This is empty if HISTORY_INDEX is off or Python has no sqlite3.
+  """
+  if not HISTORY_INDEX or sqlite3 is None:
+    return []
+  done_filename = os.path.join(os.path.dirname(filename), DONE_TEXT_FILE_NAME)
+  return [HistoryIndex(filename), HistoryIndex(done_filename)]
+
+
+class DayScheduler(object):
+  """Refreshes date-dependent Task state when the day rolls over.
+
+  A Task only looks different on certain days: when it becomes stale (the '!'
+  icon) or when a completed task drops out of the TaskPanel. Rather than asking
+  every Task about the date on every redraw, each Task is bucketed by the next
+  date on which it changes. An alarm on the urwid main loop fires at midnight
+  and only the Tasks in the buckets that have come due get refreshed.
+  """
+
+  def __init__(self, app, todotxtfile):
+    self.app = app
+    self.todotxtfile = todotxtfile
+    self._buckets = collections.defaultdict(set)   # date -> set of Tasks
+    self._scheduled = {}                           # Task -> date
+    self._alarm = None
+    self._main_loop = None
+    for task in todotxtfile.tasks:
+      self.Schedule(task)
+
+  def Schedule(self, task):
+    """Bucket a Task by the next date it changes state, if any."""
+    change_date = task.NextStateChangeDate(self.todotxtfile.today)
+    if change_date is not None:
+      self._buckets[change_date].add(task)
+      self._scheduled[task] = change_date
+
+  def Unschedule(self, task):
+    """Forget about a Task, e.g. because it was deleted."""
+    change_date = self._scheduled.pop(task, None)
+    if change_date is not None:
+      bucket = self._buckets[change_date]
+      bucket.discard(task)
+      if not bucket:
+        del self._buckets[change_date]
+
+  def Reschedule(self, task):
+    """Re-bucket a Task after its dates or completion changed."""
+    self.Unschedule(task)
+    self.Schedule(task)
+
+  def Start(self, main_loop):
+    """Begin watching for day boundaries on the given urwid MainLoop."""
+    self._main_loop = main_loop
+    self._SetAlarm()
+
+  def _SetAlarm(self):
+    tomorrow = self.todotxtfile.today + datetime.timedelta(1)
+    midnight = datetime.datetime.combine(tomorrow, datetime.time())
+    self._alarm = self._main_loop.set_alarm_at(time.mktime(midnight.timetuple()),
+                                               self._OnDayBoundary)
+
+  def _OnDayBoundary(self, main_loop, user_data):
+    # Alarms can fire late (suspend) or a hair early (clock adjustments), so
+    #   always go by the real date and catch up on every bucket that is due.
+    new_day = datetime.date.today()
+    old_day = self.todotxtfile.today
+    if new_day > old_day:
+      self.AdvanceTo(new_day)
+    self._SetAlarm()
+
+  def AdvanceTo(self, new_day):
+    """Move "today" forward and refresh only the Tasks that changed."""
+    old_day = self.todotxtfile.today
+    due_dates = [d for d in self._buckets if d <= new_day]
+    changed = []
+    for change_date in sorted(due_dates):
+      changed.extend(self._buckets.pop(change_date))
+    for task in changed:
+      del self._scheduled[task]
+
+    self.todotxtfile.today = new_day
+    for task in changed:
+      task.RefreshWidget()
+      self.Schedule(task)
+    self.app.startDayChange(new_day, old_day, changed)
+
+
 class Application(object):
   """Main application to handle run state and event propagation.
 
@@ -918,15 +2958,27 @@ class Application(object):
              ('selected',        '',            'dark blue'),
              ('prefix:normal',   'black',       ''),
              ('prefix:selected', '',            'dark red'),
+             ('prefix:marked',   '',            'dark magenta'),
+             ('marked',          '',            'dark magenta'),
              ('editbox',         'light green,standout', ''),
-             ('editbox:caption', '',            'dark red')]
+             ('editbox:caption', '',            'dark red'),
+             ('message',         'white',       'dark red')]
+
+  def __init__(self, todotxtfile):
+    self.todotxtfile = todotxtfile
+    tasks = todotxtfile.tasks
+    self.scheduler = DayScheduler(self, todotxtfile)
+    self.history_indexes = HistoryIndexes(todotxtfile.filename)
+    self.main_loop = None
+    self._message = None
+    self._held_keys = []
+    self._input_frame = None
 
-  def __init__(self, tasks):
     # Create widgets
-    keywords =  {'projects': sorted(set(p for t in tasks for p in t.projects)),
-                 'contexts': sorted(set(c for t in tasks for c in t.contexts)),
-                 'priority': sorted(set(t.priority for t in tasks))}
-    self.keyword_panel = KeywordPanel(self, keywords)
+    self.date_index = DateIndex(tasks)
+    self.tag_index = TagIndex(tasks)
+    self.recurrences = RecurrenceSchedule(tasks)
+    self.keyword_panel = KeywordPanel(self)
     self.task_panel = TaskPanel(self, tasks)
     self.view_panel = ViewPanel(self)
     columns = urwid.Columns([(30, self.keyword_panel), self.task_panel], focus_column=0)
@@ -939,20 +2991,131 @@ class Application(object):
     if key == 'esc':
       raise urwid.ExitMainLoop()
 
+    # Memory report
+    elif key == 'm':
+      self.ShowMessage(u'\n'.join(MemoryReport(self)[0]))
+
+    # Undo/redo
+    elif key == 'u':
+      self.startUndo()
+    elif key == 'ctrl r':
+      self.startRedo()
+
     # Select view
     elif key.isdigit():
-      index = int(key)
-      if index > 0 and index <= len(VIEWS):
-        new_view = VIEWS[index -1][1:]
+      views = AllViews()
+      index = (int(key) - 1) % 10   # 0 is the tenth view
+      if index < len(views):
+        new_view = views[index][1]
         old_view = self.view_panel.selected_view
         self.startViewChange(new_view, old_view)
 
+    # Step to the previous/next view, including any past the number keys
+    elif key in ('[', ']'):
+      views = [view for _, view in AllViews()]
+      old_view = self.view_panel.selected_view
+      step = 1 if key == ']' else -1
+      new_view = views[(views.index(old_view) + step) % len(views)]
+      self.startViewChange(new_view, old_view)
+
+  def OpenPrompt(self, caption, callback):
+    """Ask for a line of text in the footer and pass it to 'callback'."""
+    prompt = Prompt(caption, callback, self)
+    self.browser.footer = urwid.AttrMap(prompt, 'editbox')
+    self.browser.focus_position = 'footer'
+    return prompt
+
+  def ClosePrompt(self):
+    self.browser.footer = None
+    self.browser.focus_position = 'body'
+
+  def ShowMessage(self, text):
+    """Show a message in the footer until the next keypress."""
+    self._message = urwid.AttrMap(urwid.Text(text), 'message')
+    self.browser.footer = self._message
+
+  def _FilterInput(self, keys, raw):
+    # Any keypress dismisses a message
+    if self._message is not None:
+      if self.browser.footer is self._message:
+        self.browser.footer = None
+      self._message = None
+
+    # Handle these keys now, then hold what comes in during the next frame
+    if self._input_frame is None:
+      self._input_frame = self.main_loop.set_alarm_in(INPUT_FRAME_SECONDS,
+                                                      self._OnInputFrame)
+      return self._CoalesceKeys(keys)
+
+    # Navigation keys wait for the frame, anything else goes right through
+    #   (after the keys held before it)
+    self._held_keys.extend(keys)
+    if all(key in REPEATABLE_KEYS for key in keys):
+      return []
+    held, self._held_keys = self._held_keys, []
+    return self._CoalesceKeys(held)
+
+  def _OnInputFrame(self, main_loop, user_data):
+    held, self._held_keys = self._held_keys, []
+    if held:
+      self._input_frame = main_loop.set_alarm_in(INPUT_FRAME_SECONDS,
+                                                 self._OnInputFrame)
+      main_loop.process_input(self._CoalesceKeys(held))
+    else:
+      self._input_frame = None
+
+  def _CoalesceKeys(self, keys):
+    # Keys typed into a prompt or a task being edited are text
+    if self.browser.focus_position == 'footer' or self.task_panel.IsEditing():
+      return keys
+    return CoalesceKeys(keys)
+
   def Run(self):
+    """Run the UI, doing all file I/O in the background.
+
+    If the TodoTxtFile has not been loaded yet, the UI comes up right away and
+    fills in as chunks of the file are parsed. The file is also checked every
+    WATCH_INTERVAL_SECONDS for changes made by others.
+    """
     self.main_loop = urwid.MainLoop(self.browser,
                                     palette=Application.PALETTE,
+                                    input_filter=self._FilterInput,
                                     unhandled_input=self._UnhandledInput)
+    self.worker = BackgroundWorker(self.main_loop)
+    self.todotxtfile.worker = self.worker
+    self.todotxtfile.on_change = self._BroadcastTaskChange
+    if not self.todotxtfile.loaded:
+      self.task_panel.SetStatus('loading')
+      self.worker.Submit(self.todotxtfile.LoadInChunks, (), self._OnLoadProgress)
+    if self.todotxtfile.loaded:
+      self._MaterializeRecurrences()
+    self.scheduler.Start(self.main_loop)
+    self._UpdateHistoryIndexes()
+    self.main_loop.set_alarm_in(WATCH_INTERVAL_SECONDS, self._OnWatchAlarm)
     self.main_loop.run()
 
+  def _UpdateHistoryIndexes(self):
+    # Queued behind any file I/O, so this indexes what we last wrote or read
+    for index in self.history_indexes:
+      self.worker.Submit(index.Update)
+
+  def _OnLoadProgress(self, result):
+    kind, value = result
+    if kind == 'lines':
+      self._BroadcastTaskChange(self.todotxtfile.AddLoadedLines(value))
+      self.keyword_panel.ResetFocus()
+      self.task_panel.SetStatus('loading %d tasks' % len(self.todotxtfile.tasks))
+    else:
+      self._BroadcastTaskChange(self.todotxtfile.FinishLoading(*value))
+      self.keyword_panel.ResetFocus()
+      self.task_panel.SetStatus('')
+      self._MaterializeRecurrences()
+
+  def _OnWatchAlarm(self, main_loop, user_data):
+    self.todotxtfile.Sync()
+    self._UpdateHistoryIndexes()
+    main_loop.set_alarm_in(WATCH_INTERVAL_SECONDS, self._OnWatchAlarm)
+
   def startViewChange(self, new_view, old_view):
     """Master doViewChange function which calls the others."""
     self.view_panel.doViewChange(new_view, old_view)
@@ -965,15 +3128,408 @@ class Application(object):
     self.keyword_panel.doKeywordChange(new_keyword, old_keyword)
     self.task_panel.doKeywordChange(new_keyword, old_keyword)
 
+  def startTaskChange(self, changes):
+    """Apply a batch of (task, new_text) changes as one transaction.
+
+    The file is written once and then everybody is told about all of the
+    changes together, so each widget only has to regroup once. Recurring
+    tasks that get completed bring their next instance into the same batch.
+    """
+    changes = self.todotxtfile.ApplyChanges(self._CompleteRecurrences(changes))
+    self._BroadcastTaskChange(changes)
+    return changes
+
+  def _OpenSeries(self, excluded=()):
+    """The RecurrenceSeries of every open Task not in 'excluded'."""
+    return set(RecurrenceSeries(task) for task in self.todotxtfile.tasks
+               if not task.completed and task not in excluded)
+
+  def _CompleteRecurrences(self, changes):
+    today = self.todotxtfile.today
+    completed = []
+    open_series = None
+    for task, new_text in changes:
+      if task is not None and not task.completed and new_text:
+        new = ParsedTask(Task._Parse(new_text))
+        date = new.completed and RecurrenceDate(new)
+        # Next instances with a later t: date are left to the schedule
+        if date and date <= today:
+          if open_series is None:
+            open_series = self._OpenSeries(set(t for t, _ in changes))
+          # Unless the series already has an open instance
+          series = RecurrenceSeries(new)
+          if series not in open_series:
+            open_series.add(series)
+            completed.append((task, WithoutRecurrence(new_text)))
+            completed.append((None, NextRecurrence(new, new.completion_date or today)))
+            continue
+      completed.append((task, new_text))
+    return completed
+
+  def _MaterializeRecurrences(self):
+    """Create the next instances of recurring tasks that are due, in one batch.
+
+    Completed tasks can keep their rec: when another tool (like a todo.sh
+    add-on) manages the recurrence, so a series that already has an open
+    instance is left alone, and otherwise only its most recently completed
+    instance gets a next one.
+    """
+    today = self.todotxtfile.today
+    series_tasks = collections.defaultdict(list)
+    for task in self.recurrences.Due(today):
+      series_tasks[RecurrenceSeries(task)].append(task)
+    if not series_tasks:
+      return
+
+    changes = []
+    open_series = self._OpenSeries()
+    for series, tasks in sorted(series_tasks.items()):
+      if series in open_series:
+        continue
+      latest = max(tasks, key=lambda t: t.completion_date or datetime.date.min)
+      changes.extend((task, WithoutRecurrence(task.text)) for task in tasks)
+      changes.append((None, NextRecurrence(latest, latest.completion_date or today)))
+    if changes:
+      self.startTaskChange(changes)
+
+  def startUndo(self):
+    """Undo the last batch of changes and tell everybody about it."""
+    self._BroadcastTaskChange(self.todotxtfile.Undo())
+
+  def startRedo(self):
+    """Redo the last undone batch of changes and tell everybody about it."""
+    self._BroadcastTaskChange(self.todotxtfile.Redo())
+
+  def _BroadcastTaskChange(self, changes):
+    for task, old_text, new_text in changes:
+      if new_text is None:
+        self.scheduler.Unschedule(task)
+      else:
+        self.scheduler.Reschedule(task)
+    self.date_index.doTaskChange(changes)
+    self.tag_index.doTaskChange(changes)
+    self.recurrences.doTaskChange(changes)
+    self.view_panel.doTaskChange(changes)
+    self.keyword_panel.doTaskChange(changes)
+    self.task_panel.doTaskChange(changes)
+
+    conflicts = self.todotxtfile.conflicts
+    if conflicts:
+      lines = [u'%s was changed elsewhere in %d conflicting place(s). '
+               u'Both versions were kept:' % (self.todotxtfile.filename, len(conflicts))]
+      for mine, theirs in conflicts:
+        lines.extend(u'  ours:   %s' % line.decode('utf-8', 'replace') for line in mine)
+        lines.extend(u'  theirs: %s' % line.decode('utf-8', 'replace') for line in theirs)
+      self.ShowMessage(u'\n'.join(lines))
+      self.todotxtfile.conflicts = []
+
+  def startDayChange(self, new_day, old_day, tasks):
+    """Master doDayChange function which calls the others."""
+    self.view_panel.doDayChange(new_day, old_day, tasks)
+    self.keyword_panel.doDayChange(new_day, old_day, tasks)
+    self.task_panel.doDayChange(new_day, old_day, tasks)
+    self._MaterializeRecurrences()
+
+
+def DeepSizeOf(roots, seen):
+  """Bytes taken by the objects reachable from roots that are not in seen.
+
+  'seen' is a set of object ids which is added to, so sizing one thing after
+  another never counts the same object twice. Classes, modules and functions
+  are shared by everything and are not counted, nor followed.
+  """
+  shared = (type, types.ModuleType, types.FunctionType, types.MethodType,
+            types.BuiltinFunctionType)
+  size = 0
+  stack = list(roots)
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen or isinstance(obj, shared):
+      continue
+    seen.add(id(obj))
+    size += sys.getsizeof(obj)
+    stack.extend(gc.get_referents(obj))
+  return size
+
+
+def MemoryReport(app, top=10):
+  """Report where the memory of a loaded Application goes.
+
+  Returns the report as a list of lines and the total number of bytes.
+  Everything is sized once, in the order reported: the Tasks (with their
+  widgets and cached canvases), then each view's TaskListBoxes and TaskPiles,
+  then the indexes. The top allocation sites come from tracemalloc when it is
+  tracing, otherwise the object types taking the most memory are listed.
+  """
+  tasks = app.todotxtfile.tasks
+  count = max(len(tasks), 1)
+  # Never follow references back up to the whole application
+  seen = set(id(obj) for obj in (app, app.todotxtfile, app.browser,
+                                 app.view_panel, app.keyword_panel,
+                                 app.task_panel, app.scheduler))
+
+  lines = [u'Memory for %d tasks in %s:' % (len(tasks), app.todotxtfile.filename)]
+  total = task_bytes = DeepSizeOf(tasks, seen)
+  lines.append(u'  tasks          %10d bytes  (%d per task)' % (task_bytes,
+                                                              task_bytes / count))
+  listboxes = app.task_panel._listboxes
+  for label, category, grouping in VIEWS:
+    view_bytes = DeepSizeOf([lb for key, lb in listboxes.items()
+                             if key[0] == category and key[2] == grouping], seen)
+    lines.append(u'  view %-9s %10d bytes' % (label, view_bytes))
+    total += view_bytes
+  for label, listbox in sorted(app.task_panel._saved_listboxes.items()):
+    view_bytes = DeepSizeOf([listbox], seen)
+    lines.append(u'  view %-9s %10d bytes' % (label, view_bytes))
+    total += view_bytes
+  for label, index in ((u'keywords', [app.tag_index, app.keyword_panel._walkers]),
+                       (u'dates', app.date_index)):
+    index_bytes = DeepSizeOf([index], seen)
+    lines.append(u'  %-14s %10d bytes' % (label, index_bytes))
+    total += index_bytes
+  lines.append(u'  total          %10d bytes  (%d per task, budget %d)'
+               % (total, total / count, MemoryBudget(app)))
+
+  if tracemalloc is not None and tracemalloc.is_tracing():
+    lines.append(u'Top allocation sites:')
+    for stat in tracemalloc.take_snapshot().statistics('lineno')[:top]:
+      lines.append(u'  %s' % stat)
+  else:
+    sizes = collections.defaultdict(lambda: [0, 0])
+    for obj in gc.get_objects():
+      entry = sizes[type(obj).__name__]
+      entry[0] += 1
+      entry[1] += sys.getsizeof(obj)
+    lines.append(u'Top object types (no tracemalloc):')
+    for name, (number, size) in sorted(sizes.items(), key=lambda item: -item[1][1])[:top]:
+      lines.append(u'  %-24s %8d objects %10d bytes' % (name, number, size))
+  return lines, total
+
+
+def MemoryBudget(app):
+  """How many bytes a loaded Application may take in MemoryReport."""
+  listboxes = (app.task_panel._listboxes.values() +
+               app.task_panel._saved_listboxes.values())
+  piles = [pile for listbox in listboxes for pile in listbox.body]
+  return (MEMORY_BUDGET_BASE +
+          MEMORY_BUDGET_PER_TASK * len(app.todotxtfile.tasks) +
+          MEMORY_BUDGET_PER_LISTBOX * len(listboxes) +
+          MEMORY_BUDGET_PER_PILE * len(piles) +
+          MEMORY_BUDGET_PER_PLACEMENT * sum(len(pile.tasks) for pile in piles))
+
+
+EXPORT_FIELDS = ('line', 'text', 'completed', 'completion_date', 'priority',
+                 'creation_date', 'body', 'projects', 'contexts', 'metadata')
+
+
+def ExportFilter(spec):
+  """The predicate(task, today) for one filter given to --export.
+
+  '+project', '@context' and '(A)' keep the tasks with that keyword, the label
+  of one of the DUE_RANGES (like 'overdue') or SAVED_VIEWS keeps the tasks that
+  view shows, and anything else is one of the filters of saved views (see
+  SAVED_VIEWS). Raises ValueError for anything else.
+  """
+  if spec.startswith('+'):
+    return lambda task, today: spec[1:] in task.projects
+  elif spec.startswith('@'):
+    return lambda task, today: spec[1:] in task.contexts
+  elif len(spec) == 3 and spec.startswith('(') and spec.endswith(')'):
+    return lambda task, today: task.priority == spec[1]
+  for label, _, _ in DUE_RANGES:
+    if spec == label:
+      return lambda task, today: (task.IsVisible(today) and
+                                  spec in TaskKeywords(task, 'due', today))
+  for label, category, keyword, _, filters in SAVED_VIEWS:
+    if spec == label:
+      predicates = [ViewFilter(f) for f in filters]
+      return lambda task, today: (task.IsVisible(today) and
+                                  keyword in TaskKeywords(task, category, today) and
+                                  all(p(task, today) for p in predicates))
+  return ViewFilter(spec)
+
+
+def ExportRecords(filename, predicates, today):
+  """Yield the parsed fields of each task passing all predicates, in order.
+
+  The file is read and parsed one line at a time.
+  """
+  with open(filename) as f:
+    for number, line in enumerate(f, 1):
+      text = line.rstrip('\r\n')
+      if not text.strip():
+        continue
+      values = Task._Parse(text)
+      if all(p(ParsedTask(values), today) for p in predicates):
+        values['line'] = number
+        yield values
+
+
+def WriteJsonLines(records, out):
+  """Write records as JSON Lines, with text decoded from UTF-8 as best it can.
+
+  A line that is not valid UTF-8 gets U+FFFD for its bad bytes rather than
+  stopping the export.
+  """
+  def Decoded(value):
+    if isinstance(value, str):
+      return value.decode('utf-8', 'replace')
+    elif isinstance(value, list):
+      return [Decoded(v) for v in value]
+    elif isinstance(value, dict):
+      return dict((Decoded(k), Decoded(v)) for k, v in value.items())
+    return value
+  def Default(value):
+    if isinstance(value, datetime.date):
+      return value.isoformat()
+    raise TypeError(repr(value))
+  for record in records:
+    out.write(json.dumps(dict((k, Decoded(record[k])) for k in EXPORT_FIELDS),
+                         default=Default, sort_keys=True))
+    out.write('\n')
+
+
+def WriteCsv(records, out):
+  """Write records as CSV, with lists space-separated like in todo.txt."""
+  def Cell(value):
+    if value is None:
+      return ''
+    elif isinstance(value, datetime.date):
+      return value.isoformat()
+    elif isinstance(value, dict):
+      return ' '.join('%s:%s' % (k, Cell(v)) for k, v in sorted(value.items()))
+    elif isinstance(value, list):
+      return ' '.join(value)
+    elif isinstance(value, unicode):
+      return value.encode('utf-8')
+    return value
+  writer = csv.writer(out)
+  writer.writerow(EXPORT_FIELDS)
+  for record in records:
+    writer.writerow([Cell(record[k]) for k in EXPORT_FIELDS])
+
+
+def ImportLines(filename):
+  """Yield the task text of each record of a --export file, one at a time.
+
+  Files ending in .csv are read as CSV and anything else as JSON Lines.
+  """
+  with open(filename) as f:
+    if filename.endswith('.csv'):
+      for row in csv.DictReader(f):
+        yield row['text']
+    else:
+      for line in f:
+        if line.strip():
+          yield json.loads(line)['text']
+
+
+def PrintHistory(filename, query=None):
+  """Print tasks matching a search query, or a report of completed tasks.
+
+  This brings the HistoryIndexes up to date first, then only queries them.
+  The query is in the locale's encoding (or UTF-8), the output is UTF-8.
+  """
+  indexes = HistoryIndexes(filename)
+  if not indexes:
+    sys.exit('History needs HISTORY_INDEX on and Python with sqlite3')
+  if isinstance(query, str):
+    try:
+      query = query.decode(locale.getpreferredencoding() or 'utf-8')
+    except (UnicodeDecodeError, LookupError):   # Like a C locale
+      query = query.decode('utf-8', 'replace')
+
+  def Print(text):
+    sys.stdout.write(text.encode('utf-8') + '\n')
+
+  for index in indexes:
+    name = index.filename.decode('utf-8', 'replace')
+    index.Update()
+    if index.disabled:
+      sys.exit('Could not index %s' % index.filename)
+    if query is not None:
+      try:
+        results = index.Search(query)
+      except sqlite3.OperationalError as error:
+        if 'locked' in str(error):
+          sys.exit('%s is busy, try again' % index.index_filename)
+        sys.exit('Bad search query: %s\n%s' % (error, USAGE % {'prog': sys.argv[0]}))
+      for line, text in results:
+        Print(u'%s:%d: %s' % (name, line + 1, text))
+    else:
+      Print(u'%s (completed tasks):' % name)
+      for category, prefix in (('projects', '+'), ('contexts', '@')):
+        for tag, count in index.CompletedCounts(category):
+          Print(u'  %6d  %s%s' % (count, prefix, tag))
+
+
+USAGE = """usage: %(prog)s [todo.txt]
+       %(prog)s --search QUERY [todo.txt]
+       %(prog)s --report [todo.txt]
+       %(prog)s --memory [todo.txt]
+       %(prog)s --export jsonl|csv [--filter FILTER]... [todo.txt]
+       %(prog)s --import FILE [todo.txt]"""
+
 
 def main():
-  if len(sys.argv) > 1:
-    filename = sys.argv[1]
+  # Without the UI, history can be searched and reported on, memory use can be
+  #   reported on (failing if over the memory budget), and tasks can be
+  #   exported to stdout (keeping those that pass every ExportFilter) or
+  #   imported from a file that was exported
+  args = sys.argv[1:]
+  command = argument = None
+  filters = []
+  while args and args[0].startswith('--'):
+    option = args.pop(0)
+    if option in ('--report', '--memory'):
+      command = option
+    elif option in ('--search', '--export', '--import', '--filter') and args:
+      if option == '--filter':
+        try:
+          filters.append(ExportFilter(args.pop(0)))
+        except ValueError as error:
+          sys.exit('%s\n%s' % (error, USAGE % {'prog': sys.argv[0]}))
+      else:
+        command, argument = option, args.pop(0)
+    else:
+      sys.exit(USAGE % {'prog': sys.argv[0]})
+  if command == '--export' and argument not in ('jsonl', 'csv'):
+    sys.exit(USAGE % {'prog': sys.argv[0]})
+
+  if args:
+    filename = args[0]
   else:
     filename = TODO_TEXT_FILE
 
-  todotxtfile = TodoTxtFile(filename)
-  app = Application(todotxtfile.tasks)
+  if command == '--memory':
+    if tracemalloc is not None:
+      tracemalloc.start()
+    app = Application(TodoTxtFile(filename))
+    lines, total = MemoryReport(app)
+    print(u'\n'.join(lines))
+    if total > MemoryBudget(app):
+      sys.exit('Over the memory budget')
+    return
+  elif command == '--export':
+    records = ExportRecords(filename, filters, datetime.date.today())
+    if argument == 'csv':
+      WriteCsv(records, sys.stdout)
+    else:
+      WriteJsonLines(records, sys.stdout)
+    return
+  elif command == '--import':
+    todotxtfile = TodoTxtFile(filename, load=False)
+    count = todotxtfile.AppendLines(ImportLines(argument))
+    print('Imported %d tasks into %s' % (count, filename))
+    return
+  elif command is not None:
+    PrintHistory(filename, argument)
+    return
+
+  # The Application loads the file itself once the UI is up
+  todotxtfile = TodoTxtFile(filename, persist_history=PERSIST_UNDO_HISTORY,
+                            load=False)
+  app = Application(todotxtfile)
   app.Run()
 
 